@@ -0,0 +1,58 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List, Tuple
+
+from pymongo import UpdateOne
+
+DAY = "day"
+WEEK = "week"
+
+# Leaderboard windows answered from buckets: window -> bucket granularity
+WINDOW_GRANULARITY = {"day": DAY, "week": WEEK, "month": DAY}
+
+
+def as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def bucket_start(granularity: str, value: datetime) -> datetime:
+    """Start of the UTC day, or of the ISO week (Monday), containing `value`."""
+    day = as_utc(value).replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == WEEK:
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def window_start(window: str, now: datetime) -> Tuple[str, datetime]:
+    """Granularity and first bucket of a calendar window ending now."""
+    if window == "month":
+        return DAY, bucket_start(DAY, now).replace(day=1)
+    granularity = WINDOW_GRANULARITY[window]
+    return granularity, bucket_start(granularity, now)
+
+
+def _bucket_updates(completed_dicts: List[dict]):
+    totals = defaultdict(lambda: [0, 0])
+    for completed in completed_dicts:
+        for granularity in (DAY, WEEK):
+            key = (completed["child_id"], granularity, bucket_start(granularity, completed["completed_at"]))
+            totals[key][0] += 1
+            totals[key][1] += completed.get("fun_credits_earned", 0)
+    return totals
+
+
+async def record_activity(db, completed_dicts: List[dict]):
+    """Fold completions into the child's day and ISO-week buckets."""
+    operations = [
+        UpdateOne(
+            {"child_id": child_id, "granularity": granularity, "start": start},
+            {"$inc": {"challenges": challenges, "credits": credits}},
+            upsert=True,
+        )
+        for (child_id, granularity, start), (challenges, credits) in _bucket_updates(completed_dicts).items()
+    ]
+    if operations:
+        await db.activity_buckets.bulk_write(operations, ordered=False)
+
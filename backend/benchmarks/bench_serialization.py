@@ -0,0 +1,79 @@
+"""Compare the two ways read routes can turn Mongo rows into a JSON body.
+
+model:  Model(**parse_from_mongo(doc)) per row, then FastAPI validates the
+        list against response_model again and renders it with JSONResponse
+direct: projected rows rendered once by FastJSONResponse
+
+Usage: python benchmarks/bench_serialization.py [--items 1000] [--repeat 200]
+"""
+import argparse
+import sys
+import timeit
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from responses import FastJSONResponse, orjson  # noqa: E402
+from server import Challenge, Child, parse_from_mongo  # noqa: E402
+
+
+def child_rows(n):
+    return [{
+        "id": str(uuid.uuid4()),
+        "name": f"Enfant {i}",
+        "age": 4 + i % 10,
+        "interests": ["lecture", "sport", "nature"],
+        "screen_time_goal": 60,
+        "created_at": datetime.now(timezone.utc),
+    } for i in range(n)]
+
+
+def challenge_rows(n):
+    return [{
+        "id": str(uuid.uuid4()),
+        "title": f"Défi {i}",
+        "description": "Passe 30 minutes à faire une activité que tu aimes sans écran!",
+        "category": "outdoor",
+        "age_range": [6, 11],
+        "duration_minutes": 30,
+        "fun_credits": 20,
+        "difficulty": "easy",
+        "created_at": datetime.now(timezone.utc),
+    } for i in range(n)]
+
+
+def model_path(model, rows):
+    # What the routes did before: build models, then response_model validation
+    adapter = TypeAdapter(List[model])
+    items = [model(**parse_from_mongo(dict(row))) for row in rows]
+    content = adapter.dump_python(adapter.validate_python(items), mode="json")
+    return JSONResponse(content).body
+
+
+def direct_path(rows):
+    return FastJSONResponse(rows).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+    for name, model, rows in (("children", Child, child_rows(args.items)),
+                              ("challenges", Challenge, challenge_rows(args.items))):
+        before = min(timeit.repeat(lambda: model_path(model, rows), number=1, repeat=args.repeat))
+        after = min(timeit.repeat(lambda: direct_path(rows), number=1, repeat=args.repeat))
+        print(f"{name:11} {args.items} items  model: {before * 1000:7.2f} ms  "
+              f"direct: {after * 1000:7.2f} ms  x{before / after:.1f}")
+
+
+if __name__ == "__main__":
+    main()
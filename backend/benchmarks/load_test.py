@@ -0,0 +1,353 @@
+"""Drive concurrent load at every API route and compare it to a baseline.
+
+The app is booted in-process (ASGI transport, or --uvicorn for a real HTTP
+server on localhost) against a throwaway database on the local mongod from
+MONGO_URL, or against mongomock-motor with --in-memory. The LLM providers
+are replaced by a deterministic fake whose latency is set by --llm-latency.
+
+--in-memory is a quick smoke run only: mongomock has no $lookup with a
+pipeline, so the leaderboard routes are skipped, and its timings say
+nothing about mongod, so the run is never saved as nor compared to the
+baseline. Guarded routes are only checked against a real mongod.
+
+Each route is driven on its own for --requests requests at --concurrency,
+so the database commands seen during that phase can be attributed to it.
+
+Usage:
+    python benchmarks/load_test.py --families 200 --completions 20
+    python benchmarks/load_test.py --save-baseline     # record benchmarks/baseline.json
+    python benchmarks/load_test.py                     # fail if a guarded route regressed
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from pymongo import monitoring
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baseline.json"
+
+# Routes whose regressions fail the run
+GUARDED_ROUTES = ("get_leaderboard", "get_leaderboard?window=week", "get_child_stats")
+
+# Routes whose aggregations mongomock cannot run
+MONGOD_ONLY_ROUTES = ("get_leaderboard", "get_leaderboard?window=week")
+
+CATEGORIES = ["reading", "outdoor", "creative", "family", "sport", "learning"]
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts every command the driver sends, across all clients."""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class FakeChat:
+    """Stands in for LlmChat: answers after a fixed delay, derived from the prompt."""
+
+    def __init__(self, latency: float, system_message: str):
+        self.latency = latency
+        self.system_message = system_message
+
+    async def send_message(self, message) -> str:
+        await asyncio.sleep(self.latency)
+        rng = random.Random(message.text)
+        if "JSON" in message.text:
+            return json.dumps({
+                "title": "Défi nature",
+                "description": "Hey ! Viens découvrir le parc près de chez toi.",
+                "category": rng.choice(CATEGORIES),
+                "duration_minutes": rng.choice([15, 30, 45, 60]),
+                "difficulty": rng.choice(["easy", "medium", "hard"]),
+            })
+        return "Bravo à toute la famille !\n\nContinuez les défis en plein air cette semaine."
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+async def seed(server, families: int, children_per_family: int, completions: int, challenges: int) -> dict:
+    """Write the data set through the app's models and write-time rollups."""
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+
+    challenge_docs = []
+    for i in range(challenges):
+        low = rng.randint(4, 12)
+        challenge_docs.append(server.prepare_for_mongo(server.Challenge(
+            title=f"Défi {i}",
+            description="Passe 30 minutes à faire une activité que tu aimes sans écran!",
+            category=rng.choice(CATEGORIES),
+            age_range=[low, low + rng.randint(1, 5)],
+            duration_minutes=30,
+            fun_credits=rng.choice([10, 20, 30]),
+            difficulty="easy",
+        ).dict()))
+    await server.db.challenges.insert_many(challenge_docs)
+
+    family_docs, child_docs, completed_docs = [], [], []
+    for f in range(families):
+        family_children = []
+        for c in range(children_per_family):
+            child = server.Child(name=f"Enfant {f}-{c}", age=rng.randint(4, 14),
+                                 interests=rng.sample(CATEGORIES, 2))
+            child_docs.append(server.prepare_for_mongo(child.dict()))
+            family_children.append(child.id)
+            for _ in range(completions):
+                challenge = rng.choice(challenge_docs)
+                completed_docs.append(server.completion_document(server.CompletedChallenge(
+                    child_id=child.id,
+                    challenge_id=challenge["id"],
+                    fun_credits_earned=challenge["fun_credits"],
+                    completed_at=now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+                )))
+        family_docs.append(server.prepare_for_mongo(
+            server.Family(name=f"Famille {f}", children=family_children).dict()))
+
+    await server.db.children.insert_many(child_docs)
+    await server.db.families.insert_many(family_docs)
+    for start in range(0, len(completed_docs), 5000):
+        batch = completed_docs[start:start + 5000]
+        await server.db.completed_challenges.insert_many(batch)
+        await server.on_challenges_completed(batch)
+
+    return {
+        "challenges": [c["id"] for c in challenge_docs],
+        "children": [c["id"] for c in child_docs],
+        "families": [f["id"] for f in family_docs],
+    }
+
+
+def build_routes(ids: dict):
+    """(name, method, path, body) factories, one per route."""
+    rng = random.Random(7)
+    pick = rng.choice
+
+    def child():
+        return pick(ids["children"])
+
+    return [
+        ("get_children", lambda: ("GET", "/api/children?limit=100", None)),
+        ("get_child", lambda: ("GET", f"/api/children/{child()}", None)),
+        ("create_child", lambda: ("POST", "/api/children", {"name": "Nouvel enfant", "age": 8})),
+        ("get_challenges", lambda: ("GET", "/api/challenges?limit=100", None)),
+        ("get_challenges?age", lambda: ("GET", f"/api/challenges?age={rng.randint(4, 14)}", None)),
+        ("get_challenges?age&category",
+         lambda: ("GET", f"/api/challenges?age={rng.randint(4, 14)}&category={pick(CATEGORIES)}", None)),
+        ("get_challenge", lambda: ("GET", f"/api/challenges/{pick(ids['challenges'])}", None)),
+        ("create_challenge", lambda: ("POST", "/api/challenges", {
+            "title": "Défi", "description": "Sans écran", "category": "outdoor", "age_range": [6, 10],
+            "duration_minutes": 30, "fun_credits": 20, "difficulty": "easy"})),
+        ("generate_challenge", lambda: ("POST", "/api/challenges/generate", {"child_id": child()})),
+        ("complete_challenge", lambda: ("POST", "/api/challenges/complete",
+                                        {"child_id": child(), "challenge_id": pick(ids["challenges"])})),
+        ("get_families", lambda: ("GET", "/api/families?limit=100", None)),
+        ("get_family", lambda: ("GET", f"/api/families/{pick(ids['families'])}", None)),
+        ("get_child_stats", lambda: ("GET", f"/api/stats/child/{child()}", None)),
+        ("get_leaderboard", lambda: ("GET", "/api/leaderboard?limit=50", None)),
+        ("get_leaderboard?window=week", lambda: ("GET", "/api/leaderboard?limit=50&window=week", None)),
+        ("get_family_coaching", lambda: ("GET", f"/api/coaching/{pick(ids['families'])}", None)),
+    ]
+
+
+async def drive(http, make_request, requests: int, concurrency: int, counter: Optional[CommandCounter]) -> dict:
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(make_request())
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            method, path, body = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                response = await http.request(method, path, json=body)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            errors += failed
+
+    commands_before = counter.count if counter else 0
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": requests / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "db_ops_per_request": (counter.count - commands_before) / requests if counter else None,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name in GUARDED_ROUTES:
+        current, previous = results.get(name), baseline.get("routes", {}).get(name)
+        if not current:
+            continue
+        # A failing route is often a fast one, its timings must not pass for an improvement
+        if current["errors"]:
+            regressions.append(f"{name}: {current['errors']}/{current['requests']} requests failed")
+            continue
+        if not previous:
+            continue
+        for metric in ("p95_ms", "db_ops_per_request"):
+            if previous[metric] and current[metric] is not None and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {previous[metric]:.2f} -> {current[metric]:.2f}")
+    return regressions
+
+
+def print_report(results: dict):
+    print(f"{'route':32} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'db ops':>7} {'errors':>6}")
+    for name, r in results.items():
+        ops = f"{r['db_ops_per_request']:7.2f}" if r['db_ops_per_request'] is not None else f"{'-':>7}"
+        print(f"{name:32} {r['rps']:8.1f} {r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} "
+              f"{ops} {r['errors']:6}")
+
+
+async def run(args) -> int:
+    counter = CommandCounter()
+    # Must be registered before server.py creates its client
+    monitoring.register(counter)
+
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ['DB_NAME'] = f"off_bench_{uuid.uuid4().hex[:8]}"
+    # A benchmark database has no legacy timestamps to convert
+    os.environ['DATETIME_MIGRATION'] = '0'
+    if args.in_memory:
+        if args.save_baseline:
+            print("--in-memory timings cannot be a baseline, run against mongod")
+            return 2
+        import motor.motor_asyncio
+        try:
+            import mongomock_motor
+        except ImportError:
+            print("--in-memory needs mongomock-motor (pip install -r requirements.txt)")
+            return 2
+        motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+
+    import server
+
+    server.llm_gateway.chat_factory = lambda api_key, session_id, system_message, provider, model: \
+        FakeChat(args.llm_latency, system_message)
+
+    uvicorn_server = None
+    try:
+        if args.uvicorn:
+            import uvicorn
+            uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, port=args.port, log_level="warning"))
+            serving = asyncio.create_task(uvicorn_server.serve())
+            while not uvicorn_server.started:
+                await asyncio.sleep(0.05)
+            http = httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60)
+        else:
+            await server.app.router.startup()
+            http = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app, raise_app_exceptions=False), base_url="http://bench", timeout=60)
+
+        print(f"seeding {args.families} families x {args.children} children x {args.completions} completions, "
+              f"{args.challenges} challenges")
+        ids = await seed(server, args.families, args.children, args.completions, args.challenges)
+        # Let the catalog pick up the seeded challenges before measuring
+        await server.catalog.refresh()
+
+        results = {}
+        async with http:
+            for name, make_request in build_routes(ids):
+                if args.routes and name not in args.routes:
+                    continue
+                if args.in_memory and name in MONGOD_ONLY_ROUTES:
+                    print(f"skipping {name}: needs mongod")
+                    continue
+                # mongomock does not go through the driver, so it emits no command events
+                results[name] = await drive(http, make_request, args.requests, args.concurrency,
+                                            None if args.in_memory else counter)
+        print_report(results)
+    finally:
+        if uvicorn_server is not None:
+            uvicorn_server.should_exit = True
+            await serving
+        else:
+            await server.app.router.shutdown()
+        if not args.in_memory:
+            client = server.AsyncIOMotorClient(os.environ['MONGO_URL'])
+            await client.drop_database(os.environ['DB_NAME'])
+            client.close()
+
+    report = {
+        "params": {k: getattr(args, k) for k in ("families", "children", "completions", "challenges",
+                                                 "requests", "concurrency", "llm_latency")},
+        "routes": results,
+    }
+    if args.in_memory:
+        print("in-memory run, not compared to the baseline")
+        return 0
+    if args.save_baseline:
+        BASELINE_PATH.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"baseline saved to {BASELINE_PATH}")
+        return 0
+    if not BASELINE_PATH.exists():
+        print("no baseline yet, run with --save-baseline")
+        return 0
+
+    baseline = json.loads(BASELINE_PATH.read_text())
+    if baseline.get("params") != report["params"]:
+        print("warning: baseline was recorded with different parameters")
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--families", type=int, default=100)
+    parser.add_argument("--children", type=int, default=3, help="children per family")
+    parser.add_argument("--completions", type=int, default=20, help="completions per child")
+    parser.add_argument("--challenges", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per fake LLM call")
+    parser.add_argument("--routes", nargs="*", help="only run these routes")
+    parser.add_argument("--in-memory", action="store_true", help="smoke run on mongomock-motor, without the leaderboard routes or baseline")
+    parser.add_argument("--uvicorn", action="store_true", help="serve over HTTP instead of the ASGI transport")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing")
+    parser.add_argument("--save-baseline", action="store_true")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import asyncio
+import bisect
+import logging
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+VERSION_ID = "challenge_catalog"
+
+# Ages are indexed one by one; older ones are answered by MongoDB
+MAX_INDEXED_AGE = 25
+
+# Incremental refreshes re-read challenges created this long before the
+# previous refresh, so a write that lands late is still picked up
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+class ChallengeCatalog:
+    """In-memory copy of the challenge catalog held by each worker.
+
+    Ids are kept sorted per (category, age) key, where either part may be
+    None for "any", so a filtered, keyset-paginated listing is a dict lookup
+    plus a bisect. Writers bump a version counter in MongoDB; every worker
+    polls it and loads the challenges created since its last refresh. A full
+    reload runs every `full_reload_interval` seconds as a safety net.
+    """
+
+    def __init__(self, db, fields: Dict[str, int], poll_interval: float = 2.0, full_reload_interval: float = 600.0):
+        self.db = db
+        self.fields = fields
+        self.poll_interval = poll_interval
+        self.full_reload_interval = full_reload_interval
+        self.version = -1
+        self.latest_version = -1
+        self.loaded_at: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.refreshes = 0
+        # Incremented on every full load, which may drop or reorder challenges
+        self.generation = 0
+        self._docs: Dict[str, dict] = {}
+        self._index: Dict[Tuple[Optional[str], Optional[int]], List[str]] = {}
+        self._refreshed_since: Optional[datetime] = None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded_at is not None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _keys(self, doc: dict):
+        category = doc.get("category")
+        yield None, None
+        yield category, None
+        age_range = doc.get("age_range") or []
+        if len(age_range) == 2:
+            for age in range(max(age_range[0], 0), min(age_range[1], MAX_INDEXED_AGE) + 1):
+                yield None, age
+                yield category, age
+
+    def _insert(self, docs: Dict[str, dict], index: Dict, doc: dict):
+        challenge_id = doc["id"]
+        if challenge_id in docs:
+            return
+        docs[challenge_id] = {field: doc.get(field) for field in self.fields if field != "_id"}
+        for key in self._keys(doc):
+            bisect.insort(index.setdefault(key, []), challenge_id)
+
+    def add(self, doc: dict):
+        self._insert(self._docs, self._index, doc)
+
+    def get(self, challenge_id: str) -> Optional[dict]:
+        return self._docs.get(challenge_id)
+
+    def documents(self):
+        """Challenges in insertion order; between full loads new ones only come last."""
+        return iter(self._docs.values())
+
+    def covers(self, age: Optional[int]) -> bool:
+        return self.ready and (age is None or age <= MAX_INDEXED_AGE)
+
+    def query(self, category: Optional[str], age: Optional[int], after: Optional[str], limit: int) -> List[dict]:
+        """Challenges matching the filters, ordered by id, after the cursor."""
+        ids = self._index.get((category, age), [])
+        start = bisect.bisect_right(ids, after) if after is not None else 0
+        return [self._docs[challenge_id] for challenge_id in ids[start:start + limit]]
+
+    async def _read_version(self) -> int:
+        doc = await self.db.counters.find_one({"_id": VERSION_ID})
+        return doc["seq"] if doc else 0
+
+    async def bump_version(self):
+        """Tell every worker the catalog changed. Call after the write."""
+        doc = await self.db.counters.find_one_and_update(
+            {"_id": VERSION_ID}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        self.latest_version = doc["seq"]
+        self._wake.set()
+
+    async def load(self):
+        started = datetime.now(timezone.utc)
+        version = await self._read_version()
+        docs: Dict[str, dict] = {}
+        index: Dict[Tuple[Optional[str], Optional[int]], List[str]] = {}
+        async for doc in self.db.challenges.find({}, self.fields).sort("id", 1):
+            self._insert(docs, index, doc)
+        # Swap in one step so readers never see a half-built catalog
+        self._docs, self._index = docs, index
+        self.generation += 1
+        self.version = self.latest_version = version
+        self._refreshed_since = started
+        self.loaded_at = self.checked_at = time.monotonic()
+        self.refreshes += 1
+
+    async def refresh(self):
+        if not self.ready or time.monotonic() - self.loaded_at > self.full_reload_interval:
+            await self.load()
+            return
+        version = await self._read_version()
+        self.latest_version = max(self.latest_version, version)
+        self.checked_at = time.monotonic()
+        if version == self.version:
+            return
+        started = datetime.now(timezone.utc)
+        async for doc in self.db.challenges.find(
+            {"created_at": {"$gte": self._refreshed_since - REFRESH_OVERLAP}}, self.fields
+        ):
+            self.add(doc)
+        self.version = version
+        self._refreshed_since = started
+        self.refreshes += 1
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Challenge catalog refresh failed: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the documents and the index."""
+        size = sys.getsizeof(self._docs) + sys.getsizeof(self._index)
+        for doc in self._docs.values():
+            size += sys.getsizeof(doc) + sum(sys.getsizeof(value) for value in doc.values())
+        for ids in self._index.values():
+            # The id strings themselves are shared with the documents
+            size += sys.getsizeof(ids)
+        return size
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "ready": self.ready,
+            "challenges": len(self._docs),
+            "index_keys": len(self._index),
+            "memory_bytes": self.memory_bytes(),
+            "version": self.version,
+            "latest_version": self.latest_version,
+            "seconds_since_check": now - self.checked_at if self.checked_at else None,
+            "seconds_since_full_load": now - self.loaded_at if self.loaded_at else None,
+            "refreshes": self.refreshes,
+        }
@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import codecs
+import csv
+import json
+import re
+from typing import AsyncIterator, Callable, List, Tuple
+
+from pydantic import ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from versions import bump_versions
+
+CSV_COLUMNS = ["title", "description", "category", "age_min", "age_max", "duration_minutes", "fun_credits", "difficulty"]
+
+# Rejected rows listed in a report; the count is always complete
+MAX_REPORTED_ERRORS = 100
+
+
+def natural_key(row: dict) -> str:
+    """Identity of a catalog row across re-imports: category plus normalised title."""
+    title = re.sub(r"\s+", " ", str(row.get("title", ""))).strip().lower()
+    return f"{str(row.get('category', '')).strip().lower()}:{title}"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a byte stream into text lines without holding more than one chunk."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def parse_jsonl(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, object]]:
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, ValueError(f"JSON invalide: {e.msg}")
+
+
+async def parse_csv(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, object]]:
+    """Parse CSV one line at a time; quoted fields cannot span lines."""
+    header = None
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [value.strip() for value in values]
+            missing = set(CSV_COLUMNS) - set(header)
+            if missing:
+                raise ValueError(f"Colonnes manquantes: {', '.join(sorted(missing))}")
+            continue
+        if len(values) != len(header):
+            yield line_no, ValueError(f"{len(values)} colonnes au lieu de {len(header)}")
+            continue
+        row = dict(zip(header, values))
+        try:
+            row["age_range"] = [int(row.pop("age_min")), int(row.pop("age_max"))]
+        except ValueError:
+            yield line_no, ValueError("age_min et age_max doivent être des entiers")
+            continue
+        yield line_no, row
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.existing = 0
+        self.rejected = 0
+        self.errors: List[dict] = []
+
+    def reject(self, line_no: int, error: str):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_no, "error": error})
+
+    def dict(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "existing": self.existing,
+            "rejected": self.rejected,
+            "errors": self.errors,
+        }
+
+
+async def _write_chunk(db, chunk: List[Tuple[int, dict]], report: ImportReport):
+    operations = [
+        UpdateOne({"natural_key": doc["natural_key"]}, {"$setOnInsert": doc}, upsert=True)
+        for _, doc in chunk
+    ]
+    try:
+        result = await db.challenges.bulk_write(operations, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for error in details.get("writeErrors", []):
+            report.reject(chunk[error["index"]][0], error.get("errmsg", "Erreur d'écriture"))
+    report.inserted += details.get("nUpserted", 0)
+    report.existing += details.get("nMatched", 0)
+
+
+async def import_challenges(db, rows: AsyncIterator[Tuple[int, object]], build_document: Callable[[dict], dict],
+                            chunk_size: int = 1000) -> ImportReport:
+    """Validate rows and upsert them by natural key, `chunk_size` at a time.
+
+    Existing challenges are left untouched (their metadata is cached as
+    immutable), so importing the same file twice only inserts once.
+    """
+    report = ImportReport()
+    chunk: List[Tuple[int, dict]] = []
+    async for line_no, row in rows:
+        if isinstance(row, Exception):
+            report.reject(line_no, str(row))
+            continue
+        if not isinstance(row, dict):
+            report.reject(line_no, "Chaque ligne doit être un objet")
+            continue
+        try:
+            doc = build_document(row)
+        except ValidationError as e:
+            report.reject(line_no, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        doc["natural_key"] = natural_key(doc)
+        chunk.append((line_no, doc))
+        if len(chunk) >= chunk_size:
+            await _write_chunk(db, chunk, report)
+            chunk = []
+    if chunk:
+        await _write_chunk(db, chunk, report)
+    return report
+
+
+def parse_rows(fmt: str, chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, object]]:
+    lines = iter_lines(chunks)
+    return parse_csv(lines) if fmt == "csv" else parse_jsonl(lines)
+
+
+async def _read_file(path: str, size: int = 1 << 16) -> AsyncIterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(size)
+            if not chunk:
+                break
+            yield chunk
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Import a challenge catalog (JSONL or CSV) into MongoDB")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    import server
+
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "jsonl")
+    try:
+        report = await import_challenges(
+            server.db, parse_rows(fmt, _read_file(args.path)), server.build_import_document, args.chunk_size
+        )
+        if report.inserted:
+            # Running workers load the new challenges on their next poll, and
+            # listings cached by clients stop revalidating as unchanged
+            await asyncio.gather(server.catalog.bump_version(), bump_versions(server.db, ["challenges"]))
+        print(json.dumps(report.dict(), ensure_ascii=False, indent=2))
+    finally:
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
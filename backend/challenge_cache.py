@@ -0,0 +1,76 @@
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+# Challenge fields that never change once a challenge is written
+METADATA_FIELDS = ("id", "category", "fun_credits", "age_range")
+METADATA_PROJECTION = {"_id": 0, **{field: 1 for field in METADATA_FIELDS}}
+
+
+class ChallengeMetadataCache:
+    """Process-local LRU cache of immutable challenge metadata.
+
+    Maps a challenge id to its category, fun_credits and age_range. Ids that
+    do not exist are not cached, so a challenge created by another worker is
+    picked up on the next lookup.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, challenge: dict) -> dict:
+        metadata = {field: challenge.get(field) for field in METADATA_FIELDS}
+        self._entries[metadata["id"]] = metadata
+        self._entries.move_to_end(metadata["id"])
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return metadata
+
+    def _lookup(self, challenge_id: str) -> Optional[dict]:
+        metadata = self._entries.get(challenge_id)
+        if metadata is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(challenge_id)
+        return metadata
+
+    async def get(self, db, challenge_id: str) -> Optional[dict]:
+        metadata = self._lookup(challenge_id)
+        if metadata is None:
+            challenge = await db.challenges.find_one({"id": challenge_id}, METADATA_PROJECTION)
+            if challenge:
+                metadata = self.put(challenge)
+        return metadata
+
+    async def get_many(self, db, challenge_ids: Iterable[str]) -> Dict[str, dict]:
+        """Resolve several ids with at most one `$in` query for the misses."""
+        found = {}
+        missing = []
+        for challenge_id in dict.fromkeys(challenge_ids):
+            metadata = self._lookup(challenge_id)
+            if metadata is None:
+                missing.append(challenge_id)
+            else:
+                found[challenge_id] = metadata
+
+        if missing:
+            cursor = db.challenges.find({"id": {"$in": missing}}, METADATA_PROJECTION)
+            async for challenge in cursor:
+                found[challenge["id"]] = self.put(challenge)
+        return found
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
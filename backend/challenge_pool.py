@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Placeholder the LLM writes instead of the child's name in pooled templates
+NAME_PLACEHOLDER = "{prenom}"
+
+AGE_BUCKET_SIZE = 3
+
+# Categories the generator writes; a request for any other one is not pooled
+CATEGORIES = ("reading", "outdoor", "creative", "family", "sport", "learning")
+
+# Free-text interests are pooled under the first theme one of them mentions,
+# so the number of slots stays fixed whatever children type
+INTEREST_THEMES = {
+    "lecture": ("lecture", "lire", "livre", "bd", "manga", "conte", "poésie", "reading", "book"),
+    "nature": ("nature", "plein air", "jardin", "animaux", "animal", "forêt", "randonnée", "camping", "outdoor"),
+    "sport": ("sport", "foot", "basket", "tennis", "natation", "vélo", "judo", "rugby", "gym", "danse"),
+    "arts": ("arts", "dessin", "peinture", "bricolage", "musique", "chant", "théâtre", "lego", "creative"),
+    "sciences": ("sciences", "maths", "espace", "astronomie", "expérience", "robot", "code", "learning"),
+    "famille": ("famille", "jeux de société", "cuisine", "pâtisserie", "family"),
+}
+
+
+def age_bucket(age: int) -> int:
+    """Lower bound of the age bucket `age` falls into (0-2, 3-5, 6-8, ...)."""
+    return max(0, age) // AGE_BUCKET_SIZE * AGE_BUCKET_SIZE
+
+
+def interest_theme(interests) -> Optional[str]:
+    for interest in interests or []:
+        interest = interest.strip().lower()
+        for theme, words in INTEREST_THEMES.items():
+            if any(word in interest for word in words):
+                return theme
+    return None
+
+
+def fill_template(template: dict, name: str) -> dict:
+    return {
+        key: value.replace(NAME_PLACEHOLDER, name) if isinstance(value, str) else value
+        for key, value in template.items()
+    }
+
+
+class ChallengePool:
+    """Stock of pre-generated challenge templates per (age bucket, category, interest) slot.
+
+    Templates live in the `challenge_pool` collection so every worker shares
+    the same stock; `take` pops one atomically. Slots are registered when a
+    request asks for them and a background task tops up every registered
+    slot that falls below `low_water`, running at most `concurrency`
+    generations at a time. A slot nobody took from for `slot_idle_seconds`
+    is no longer refilled, and at most `max_slots` are kept, least recently
+    taken dropped first.
+    """
+
+    def __init__(self, db, generate_template: Callable[[dict], Awaitable[dict]],
+                 target_depth: int = 5, low_water: int = 2, concurrency: int = 2,
+                 interval: float = 30.0, slot_idle_seconds: float = 3 * 86400, max_slots: int = 200):
+        self.collection = db.challenge_pool
+        self.generate_template = generate_template
+        self.target_depth = target_depth
+        self.low_water = min(low_water, target_depth)
+        self.interval = interval
+        self.slot_idle_seconds = slot_idle_seconds
+        self.max_slots = max_slots
+        self.hits = 0
+        self.misses = 0
+        self.refill_failures = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Least recently taken first
+        self._slots: "OrderedDict[str, dict]" = OrderedDict()
+        self._last_taken: Dict[str, float] = {}
+        self._low_since: Dict[str, float] = {}
+        self._refill_lags = deque(maxlen=100)
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.target_depth > 0
+
+    def slot_for(self, age: int, category: Optional[str], interests) -> Optional[dict]:
+        """The slot serving this request, or None when it cannot be pooled."""
+        if category is not None and category not in CATEGORIES:
+            return None
+        interest = interest_theme(interests)
+        bucket = age_bucket(age)
+        return {
+            "key": f"{bucket}|{category or '*'}|{interest or '*'}",
+            "age": bucket + AGE_BUCKET_SIZE // 2,
+            "category": category,
+            "interest": interest,
+        }
+
+    async def take(self, slot: dict) -> Optional[dict]:
+        """Pop a ready template for `slot`, or None when the slot is empty."""
+        if not self.enabled or slot is None:
+            return None
+        self._register(slot, time.monotonic())
+        doc = await self.collection.find_one_and_delete(
+            {"slot": slot["key"]},
+            projection={"_id": 0, "template": 1},
+            sort=[("created_at", 1)],
+        )
+        if doc:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._low_since.setdefault(slot["key"], time.monotonic())
+        # Either way the slot just lost stock, let the refill loop look at it
+        self._wake.set()
+        return doc["template"] if doc else None
+
+    def _register(self, slot: dict, taken_at: float):
+        key = slot["key"]
+        self._slots[key] = slot
+        self._slots.move_to_end(key)
+        self._last_taken[key] = taken_at
+        while len(self._slots) > self.max_slots:
+            self._forget(next(iter(self._slots)))
+
+    def _forget(self, key: str):
+        # Its stock stays in the collection and is still served if asked for again
+        self._slots.pop(key, None)
+        self._last_taken.pop(key, None)
+        self._low_since.pop(key, None)
+
+    async def _fill_one(self, slot: dict):
+        async with self._semaphore:
+            try:
+                template = await self.generate_template(slot)
+            except Exception as e:
+                self.refill_failures += 1
+                logger.warning(f"Challenge pool refill failed for slot {slot['key']}: {e}")
+                return
+        await self.collection.insert_one({
+            "slot": slot["key"],
+            "slot_params": slot,
+            "template": template,
+            "created_at": datetime.now(timezone.utc),
+        })
+
+    async def refill_once(self):
+        idle_since = time.monotonic() - self.slot_idle_seconds
+        for key in [key for key, taken_at in self._last_taken.items() if taken_at < idle_since]:
+            self._forget(key)
+        depths = await self.depths()
+        fills = []
+        for key, slot in list(self._slots.items()):
+            depth = depths.get(key, 0)
+            if depth >= self.low_water:
+                continue
+            self._low_since.setdefault(key, time.monotonic())
+            fills.extend(self._fill_one(slot) for _ in range(self.target_depth - depth))
+        if not fills:
+            return
+        await asyncio.gather(*fills)
+
+        depths = await self.depths()
+        now = time.monotonic()
+        for key in list(self._low_since):
+            if depths.get(key, 0) >= self.low_water:
+                self._refill_lags.append(now - self._low_since.pop(key))
+
+    async def depths(self) -> Dict[str, int]:
+        counts = await self.collection.aggregate([
+            {"$group": {"_id": "$slot", "depth": {"$sum": 1}}},
+        ]).to_list(None)
+        return {c["_id"]: c["depth"] for c in counts}
+
+    async def _load_slots(self):
+        # Slots stocked by a previous run keep being refilled after a restart,
+        # the most recently stocked ones kept if there are too many
+        now = time.monotonic()
+        stale, renamed = [], []
+        async for doc in self.collection.aggregate([
+            {"$group": {"_id": "$slot", "slot_params": {"$first": "$slot_params"},
+                        "stocked_at": {"$max": "$created_at"}}},
+            {"$sort": {"stocked_at": 1}},
+        ]):
+            params = doc.get("slot_params")
+            if not params:
+                continue
+            slot = self.slot_for(params["age"], params["category"], [params["interest"]] if params["interest"] else [])
+            if slot is None:
+                stale.append(doc["_id"])
+                continue
+            if slot["key"] != doc["_id"]:
+                # Stocked under the raw interest, before themes: it now serves the theme's slot
+                renamed.append((doc["_id"], slot))
+            if slot["key"] not in self._slots:
+                self._register(slot, now)
+        for key, slot in renamed:
+            await self.collection.update_many({"slot": key}, {"$set": {"slot": slot["key"], "slot_params": slot}})
+        if stale:
+            await self.collection.delete_many({"slot": {"$in": stale}})
+
+    async def run(self):
+        await self._load_slots()
+        while True:
+            try:
+                await self.refill_once()
+            except Exception as e:
+                logger.error(f"Challenge pool refill loop error: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def stats(self) -> dict:
+        depths = await self.depths()
+        lookups = self.hits + self.misses
+        lags = list(self._refill_lags)
+        now = time.monotonic()
+        return {
+            "target_depth": self.target_depth,
+            "low_water": self.low_water,
+            "slots": {key: depths.get(key, 0) for key in self._slots},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "refill_failures": self.refill_failures,
+            "refill_lag_seconds": {
+                "last": lags[-1] if lags else None,
+                "mean": sum(lags) / len(lags) if lags else None,
+                "pending_max": max((now - t for t in self._low_since.values()), default=0.0),
+            },
+        }
@@ -0,0 +1,98 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+def coaching_digest(family_name: str, children_data: List[dict]) -> str:
+    """Digest of everything the coaching prompt is built from."""
+    payload = json.dumps({"family": family_name, "children": children_data}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CoachingCache:
+    """Persisted coaching advice, one document per family.
+
+    The write routes that can change a family's coaching input mark its
+    entry stale. A fresh entry is served without recomputing the input; a
+    stale one is reused only if the recomputed input digest still matches.
+    Entries older than `max_age` seconds are ignored.
+
+    Every invalidation also increments `invalidations`. `begin` returns that
+    counter before the input is read, and `put` and `revalidate` only mark
+    the entry fresh if it has not moved since, so advice computed from input
+    that changed during the LLM call is stored stale.
+    """
+
+    def __init__(self, db, max_age: float = 86400):
+        self.collection = db.coaching_cache
+        self.max_age = max_age
+
+    async def get(self, family_id: str) -> Optional[dict]:
+        doc = await self.collection.find_one({"family_id": family_id}, {"_id": 0})
+        # An entry begun but never written holds no advice yet
+        if not doc or "created_at" not in doc:
+            return None
+        created_at = doc["created_at"]
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - created_at > timedelta(seconds=self.max_age):
+            return None
+        return doc
+
+    async def begin(self, family_id: str, child_ids: List[str]) -> int:
+        """Track invalidations of the family's entry; call before reading its input."""
+        for attempt in range(2):
+            try:
+                doc = await self.collection.find_one_and_update(
+                    {"family_id": family_id},
+                    {"$set": {"child_ids": child_ids}, "$setOnInsert": {"invalidations": 0, "stale": True}},
+                    projection={"_id": 0, "invalidations": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                return doc.get("invalidations", 0)
+            except DuplicateKeyError:
+                # Another request created the entry at the same time
+                if attempt:
+                    raise
+
+    async def put(self, family_id: str, digest: str, child_ids: List[str], advice: str, family_stats: dict,
+                  invalidations: int) -> dict:
+        doc = {
+            "family_id": family_id,
+            "digest": digest,
+            # The advice text changes on every generation even for the same input
+            "etag": hashlib.sha256(f"{digest}:{advice}".encode("utf-8")).hexdigest()[:32],
+            "child_ids": child_ids,
+            "coaching_advice": advice,
+            "family_stats": family_stats,
+            "stale": False,
+            "created_at": datetime.now(timezone.utc),
+        }
+        result = await self.collection.update_one(
+            {"family_id": family_id, "invalidations": invalidations}, {"$set": doc}
+        )
+        if not result.matched_count:
+            # The input changed while the advice was generated: keep it, but not as fresh
+            doc["stale"] = True
+            await self.collection.update_one({"family_id": family_id}, {"$set": doc}, upsert=True)
+        return doc
+
+    async def revalidate(self, family_id: str, invalidations: int):
+        await self.collection.update_one(
+            {"family_id": family_id, "invalidations": invalidations}, {"$set": {"stale": False}}
+        )
+
+    async def invalidate_family(self, family_id: str):
+        await self.collection.update_one(
+            {"family_id": family_id}, {"$set": {"stale": True}, "$inc": {"invalidations": 1}}
+        )
+
+    async def invalidate_children(self, child_ids: Iterable[str]):
+        await self.collection.update_many(
+            {"child_ids": {"$in": list(child_ids)}}, {"$set": {"stale": True}, "$inc": {"invalidations": 1}}
+        )
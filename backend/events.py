@@ -0,0 +1,173 @@
+import asyncio
+import logging
+from typing import Callable, Optional, Set
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+# Sent instead of the events a slow subscriber could not keep up with
+RESYNC = "resync"
+
+
+class Subscription:
+    """One client's bounded queue of events.
+
+    Publishing never waits on a subscriber: when its queue is full the
+    backlog is dropped and replaced by a single resync event, which tells
+    the client to refetch the state it shows.
+    """
+
+    def __init__(self, bus: "EventBus", predicate: Optional[Callable[[dict], bool]], maxsize: int):
+        self.bus = bus
+        self.predicate = predicate
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def offer(self, event: dict):
+        if self.predicate is not None and not self.predicate(event):
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.bus.dropped += self.queue.qsize()
+            self.bus.resyncs += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": RESYNC})
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next event, or None after `timeout` seconds without one."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.bus.subscribers.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LocalBroker:
+    """Delivers events to the subscribers of this worker only."""
+
+    def __init__(self):
+        self._deliver = None
+
+    async def publish(self, event: dict):
+        if self._deliver is not None:
+            self._deliver(event)
+
+    def start(self, deliver: Callable[[dict], None]):
+        self._deliver = deliver
+
+    async def stop(self):
+        self._deliver = None
+
+
+class MongoBroker:
+    """Fans events out to every worker through a capped collection.
+
+    Each worker tails the collection and delivers what it reads to its own
+    subscribers, so a completion recorded by one worker reaches clients
+    connected to any of them. Old events simply roll off the collection.
+    """
+
+    def __init__(self, db, collection: str = "live_events", size_bytes: int = 16 * 1024 * 1024,
+                 retry_interval: float = 1.0):
+        self.db = db
+        self.name = collection
+        self.size_bytes = size_bytes
+        self.retry_interval = retry_interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _ensure_collection(self):
+        try:
+            await self.db.create_collection(self.name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass
+
+    async def publish(self, event: dict):
+        # insert_one adds an _id to the document it is given
+        await self.db[self.name].insert_one(dict(event))
+
+    async def run(self, deliver: Callable[[dict], None]):
+        collection = self.db[self.name]
+        last_id = None
+        while True:
+            try:
+                if last_id is None:
+                    await self._ensure_collection()
+                    # Clients only get what happens after they connect, history is not replayed
+                    newest = await collection.find_one({}, {"_id": 1}, sort=[("$natural", -1)])
+                    last_id = newest["_id"] if newest else False
+                query = {"_id": {"$gt": last_id}} if last_id else {}
+                async for doc in collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT):
+                    last_id = doc.pop("_id")
+                    deliver(doc)
+            except Exception as e:
+                logger.error(f"Live event broker error: {e}")
+            # The cursor dies while the collection is empty or after an error
+            await asyncio.sleep(self.retry_interval)
+
+    def start(self, deliver: Callable[[dict], None]):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run(deliver))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class EventBus:
+    """Publish/subscribe of live events, through a local or shared broker."""
+
+    def __init__(self, broker=None, queue_size: int = 100):
+        self.broker = broker or LocalBroker()
+        self.queue_size = queue_size
+        self.subscribers: Set[Subscription] = set()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.resyncs = 0
+
+    def subscribe(self, predicate: Optional[Callable[[dict], bool]] = None) -> Subscription:
+        subscription = Subscription(self, predicate, self.queue_size)
+        self.subscribers.add(subscription)
+        return subscription
+
+    async def publish(self, *events: dict):
+        for event in events:
+            await self.broker.publish(event)
+            self.published += 1
+
+    def deliver(self, event: dict):
+        self.delivered += 1
+        for subscription in list(self.subscribers):
+            subscription.offer(event)
+
+    def start(self):
+        self.broker.start(self.deliver)
+
+    async def stop(self):
+        await self.broker.stop()
+
+    def stats(self) -> dict:
+        return {
+            "broker": type(self.broker).__name__,
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs,
+        }
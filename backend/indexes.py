@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import logging
+import os
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# (collection, keys, options) for every index the routes rely on
+INDEXES = [
+    ("children", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("challenges", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("families", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("completed_challenges", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    ("completed_challenges", [("child_id", ASCENDING), ("completed_at", DESCENDING)],
+     {"name": "child_id_completed_at"}),
+    # Only completions whose side effects are not all applied yet, read by the sweeper
+    ("completed_challenges", [("effects_claimed_at", ASCENDING)],
+     {"name": "pending_effects", "partialFilterExpression": {"pending_effects": {"$exists": True}}}),
+    # Set only when the client sent an Idempotency-Key, so retries are recorded once
+    ("completed_challenges", [("idempotency_key", ASCENDING)],
+     {"name": "idempotency_key_unique", "unique": True, "sparse": True}),
+    # get_challenges filters on the bounds of age_range, optionally by category
+    ("challenges", [("category", ASCENDING), ("age_range.0", ASCENDING), ("age_range.1", ASCENDING)],
+     {"name": "category_age_range"}),
+    ("challenges", [("age_range.0", ASCENDING), ("age_range.1", ASCENDING)],
+     {"name": "age_range"}),
+    # Incremental refreshes of the in-memory catalog read recent challenges
+    ("challenges", [("created_at", ASCENDING)], {"name": "created_at"}),
+    # Only imported challenges carry a natural key
+    ("challenges", [("natural_key", ASCENDING)], {"name": "natural_key_unique", "unique": True, "sparse": True}),
+    ("families", [("children", ASCENDING)], {"name": "children"}),
+    ("screen_time_daily", [("child_id", ASCENDING), ("day", ASCENDING)],
+     {"name": "child_id_day_unique", "unique": True}),
+    ("activity_buckets", [("child_id", ASCENDING), ("granularity", ASCENDING), ("start", ASCENDING)],
+     {"name": "child_granularity_start_unique", "unique": True}),
+    ("coaching_cache", [("family_id", ASCENDING)], {"name": "family_id_unique", "unique": True}),
+    ("coaching_cache", [("child_ids", ASCENDING)], {"name": "child_ids"}),
+    ("challenge_pool", [("slot", ASCENDING), ("created_at", ASCENDING)], {"name": "slot_created_at"}),
+    ("leaderboard_snapshot_entries", [("key", ASCENDING), ("version", ASCENDING)], {"name": "key_version"}),
+    ("jobs", [("id", ASCENDING)], {"name": "id_unique", "unique": True}),
+    # Set only while a job is pending or running, so identical jobs share one
+    ("jobs", [("active_key", ASCENDING)], {"name": "active_key_unique", "unique": True, "sparse": True}),
+    ("jobs", [("status", ASCENDING), ("run_after", ASCENDING)], {"name": "status_run_after"}),
+    # Finished jobs are kept a week for clients that poll late
+    ("jobs", [("finished_at", ASCENDING)], {"name": "finished_at_ttl", "expireAfterSeconds": 7 * 24 * 3600}),
+]
+
+# Representative query shape of each hot route, used by explain_query_shapes
+PROBE_ID = "index-probe"
+PROBE_AGE = 10
+PROBE_CATEGORY = "outdoor"
+
+QUERY_SHAPES = [
+    ("get_child", "children", {"id": PROBE_ID}),
+    ("get_challenge", "challenges", {"id": PROBE_ID}),
+    ("get_family", "families", {"id": PROBE_ID}),
+    ("get_child_stats", "completed_challenges", {"child_id": PROBE_ID}),
+    ("get_challenges?age", "challenges",
+     {"age_range.0": {"$lte": PROBE_AGE}, "age_range.1": {"$gte": PROBE_AGE}}),
+    ("get_challenges?category", "challenges", {"category": PROBE_CATEGORY}),
+    ("get_challenges?age&category", "challenges",
+     {"age_range.0": {"$lte": PROBE_AGE}, "age_range.1": {"$gte": PROBE_AGE}, "category": PROBE_CATEGORY}),
+    ("get_leaderboard", "completed_challenges", {"child_id": {"$in": [PROBE_ID]}}),
+]
+
+
+async def ensure_indexes(db) -> List[str]:
+    """Create every declared index. Safe to run on each startup."""
+    created = []
+    for collection, keys, options in INDEXES:
+        try:
+            name = await db[collection].create_index(keys, **options)
+            created.append(f"{collection}.{name}")
+        except OperationFailure as e:
+            # e.g. duplicate ids in legacy data; keep serving and report it
+            logger.error(f"Could not create index {options.get('name')} on {collection}: {e}")
+    return created
+
+
+def _plan_stages(plan) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+async def explain_query_shapes(db) -> List[Dict]:
+    """Run explain() on each route's query shape and report its winning plan."""
+    report = []
+    for route, collection, query in QUERY_SHAPES:
+        explanation = await db[collection].find(query).explain()
+        stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        report.append({
+            "route": route,
+            "collection": collection,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+
+async def run_diagnostics(db) -> List[Dict]:
+    report = await explain_query_shapes(db)
+    for entry in report:
+        if entry["collscan"]:
+            logger.warning(f"Query shape {entry['route']} on {entry['collection']} does a COLLSCAN: {entry['stages']}")
+    return report
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Create the OFF MongoDB indexes")
+    parser.add_argument("--explain", action="store_true", help="report query shapes that still do a COLLSCAN")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        for name in await ensure_indexes(db):
+            print(f"ok  {name}")
+        if args.explain:
+            report = await run_diagnostics(db)
+            for entry in report:
+                status = "COLLSCAN" if entry["collscan"] else "ok"
+                print(f"{status:8} {entry['route']}: {' > '.join(entry['stages'])}")
+            if any(entry["collscan"] for entry in report):
+                raise SystemExit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+FINISHED = (DONE, FAILED)
+
+# Fields returned to clients; the rest is queue bookkeeping
+JOB_FIELDS = {"_id": 0, "id": 1, "kind": 1, "status": 1, "attempts": 1, "result": 1, "error": 1,
+              "created_at": 1, "finished_at": 1}
+
+
+class PermanentJobError(Exception):
+    """The job cannot succeed, retrying would not help."""
+
+
+class JobQueue:
+    """Persisted queue of slow jobs, run by a bounded pool of async workers.
+
+    Jobs live in the `jobs` collection so any worker process can run them
+    and they survive restarts. A worker claims a job with a lease longer
+    than any LLM call; a job whose worker died is claimed again once the
+    lease expires. Failures
+    are retried with exponential backoff up to `max_attempts`.
+
+    While a job is pending or running it carries `active_key`, which is
+    unique, so submitting an identical job returns the existing one.
+    """
+
+    def __init__(self, db, workers: int = 4, max_attempts: int = 3, lease: float = 120.0,
+                 backoff: float = 2.0, poll_interval: float = 1.0):
+        self.collection = db.jobs
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease = timedelta(seconds=lease)
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.owner = str(uuid.uuid4())
+        self.handlers: Dict[str, Callable[[dict], Awaitable[dict]]] = {}
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self._wake = asyncio.Event()
+        self._finished: Dict[str, asyncio.Event] = {}
+        self._tasks = []
+
+    def register(self, kind: str, handler: Callable[[dict], Awaitable[dict]]):
+        self.handlers[kind] = handler
+
+    async def submit(self, kind: str, payload: dict, dedupe_key: Optional[str] = None) -> dict:
+        """Queue a job, or return the identical one still pending or running."""
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "payload": payload,
+            "status": PENDING,
+            "attempts": 0,
+            "run_after": now,
+            "created_at": now,
+        }
+        if dedupe_key is not None:
+            job["active_key"] = f"{kind}:{dedupe_key}"
+        try:
+            await self.collection.insert_one(job)
+        except DuplicateKeyError:
+            existing = await self.collection.find_one({"active_key": job["active_key"]}, JOB_FIELDS)
+            if existing:
+                return existing
+            # The identical job finished in between, queue a new one
+            return await self.submit(kind, payload, dedupe_key)
+        self._wake.set()
+        return {field: job.get(field) for field in JOB_FIELDS if field != "_id"}
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": job_id}, JOB_FIELDS)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[dict]:
+        """Return the job once it changes state here, or after `timeout` seconds."""
+        event = self._finished.setdefault(job_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if self._finished.get(job_id) is event and not event.is_set():
+                del self._finished[job_id]
+        return await self.get(job_id)
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": PENDING, "run_after": {"$lte": now}},
+                # Its worker died before finishing it
+                {"status": RUNNING, "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": RUNNING, "owner": self.owner, "lease_until": now + self.lease},
+             "$inc": {"attempts": 1}},
+            sort=[("run_after", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _notify(self, job_id: str):
+        event = self._finished.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+    async def _finish(self, job: dict, update: dict):
+        await self.collection.update_one({"id": job["id"], "owner": self.owner}, update)
+        self._notify(job["id"])
+
+    async def run_one(self, job: dict):
+        handler = self.handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise PermanentJobError(f"unknown job kind {job['kind']}")
+            result = await handler(job["payload"])
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back without spending an attempt
+            await self.collection.update_one(
+                {"id": job["id"], "owner": self.owner},
+                {"$set": {"status": PENDING, "run_after": datetime.now(timezone.utc)},
+                 "$inc": {"attempts": -1}, "$unset": {"owner": "", "lease_until": ""}},
+            )
+            raise
+        except Exception as e:
+            now = datetime.now(timezone.utc)
+            if isinstance(e, PermanentJobError) or job["attempts"] >= self.max_attempts:
+                self.failed += 1
+                logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}")
+                await self._finish(job, {
+                    "$set": {"status": FAILED, "error": str(e), "finished_at": now},
+                    "$unset": {"active_key": "", "owner": "", "lease_until": ""},
+                })
+            else:
+                self.retried += 1
+                delay = self.backoff ** job["attempts"]
+                logger.warning(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed, "
+                               f"retrying in {delay:.1f}s: {e}")
+                await self._finish(job, {
+                    "$set": {"status": PENDING, "error": str(e), "run_after": now + timedelta(seconds=delay)},
+                    "$unset": {"owner": "", "lease_until": ""},
+                })
+            return
+        self.processed += 1
+        await self._finish(job, {
+            "$set": {"status": DONE, "result": result, "finished_at": datetime.now(timezone.utc)},
+            "$unset": {"active_key": "", "error": "", "owner": "", "lease_until": ""},
+        })
+
+    async def worker(self):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"Job queue claim error: {e}")
+                job = None
+            if job is not None:
+                try:
+                    await self.run_one(job)
+                except Exception as e:
+                    # The job stays leased and is picked up again once the lease expires
+                    logger.error(f"Job {job['id']} could not be recorded: {e}")
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def stats(self) -> dict:
+        counts = await self.collection.aggregate([
+            {"$match": {"status": {"$in": [PENDING, RUNNING]}}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ]).to_list(None)
+        return {
+            "workers": len(self._tasks),
+            "queued": {c["_id"]: c["count"] for c in counts},
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from activity_buckets import window_start
+from migrations import ACTIVITY_BUCKETS_MIGRATION, CHILD_STATS_MIGRATION, migration_done
+
+# Completions older than this do not count towards `weekly_challenges`
+WEEKLY_WINDOW = timedelta(days=7)
+
+# Windows served from pre-aggregated documents instead of raw completions
+WINDOWS = ("day", "week", "month", "all")
+
+
+def _completed_at_as_date():
+    # Older documents store `completed_at` as an ISO string, newer ones as a
+    # BSON date. $convert handles both and yields null for anything invalid,
+    # which mirrors the "skip invalid entries" behaviour of the old loop.
+    return {
+        "$convert": {
+            "input": "$completed_at",
+            "to": "date",
+            "onError": None,
+            "onNull": None,
+        }
+    }
+
+
+def _family_totals_pipeline(lookup_from: str, foreign_field: str, per_family: List[dict],
+                            offset: int, limit: Optional[int]) -> List[dict]:
+    """Join each family's children to `lookup_from` and rank the families.
+
+    `per_family` must reduce the joined documents to at most one document
+    with `total_credits` and `weekly_challenges`.
+    """
+    pipeline = [
+        {"$project": {"_id": 1, "id": 1, "name": 1, "children": {"$ifNull": ["$children", []]}}},
+        {"$lookup": {
+            "from": lookup_from,
+            "localField": "children",
+            "foreignField": foreign_field,
+            "pipeline": per_family,
+            "as": "totals",
+        }},
+        {"$project": {
+            "_id": 1,
+            "family_id": "$id",
+            "family_name": "$name",
+            "total_credits": {"$ifNull": [{"$first": "$totals.total_credits"}, 0]},
+            "weekly_challenges": {"$ifNull": [{"$first": "$totals.weekly_challenges"}, 0]},
+        }},
+        # _id keeps the ordering of tied families stable between pages
+        {"$sort": {"total_credits": -1, "_id": 1}},
+    ]
+    if offset:
+        pipeline.append({"$skip": offset})
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$project": {"_id": 0}})
+    return pipeline
+
+
+def build_leaderboard_pipeline(week_ago: datetime, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+    """Aggregate families -> children -> completions into ranked rows.
+
+    Completions are joined on `child_id` through the family's `children`
+    array and reduced to one document per family inside the $lookup, so the
+    whole leaderboard is computed by the database in a single round trip.
+    """
+    return _family_totals_pipeline("completed_challenges", "child_id", [
+        {"$project": {"_id": 0, "fun_credits_earned": 1, "completed_at": _completed_at_as_date()}},
+        {"$group": {
+            "_id": None,
+            "total_credits": {"$sum": {"$ifNull": ["$fun_credits_earned", 0]}},
+            "weekly_challenges": {"$sum": {
+                "$cond": [{"$gt": ["$completed_at", week_ago]}, 1, 0]
+            }},
+        }},
+    ], offset, limit)
+
+
+def build_window_pipeline(window: str, now: datetime, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+    """Rank families by credits earned in a calendar window.
+
+    `all` sums the per-child rollups; shorter windows sum the child's
+    activity buckets since the window start, so the cost depends on the
+    number of buckets rather than the number of completions.
+    """
+    if window == "all":
+        return _family_totals_pipeline("child_stats", "_id", [
+            {"$group": {
+                "_id": None,
+                "total_credits": {"$sum": "$total_fun_credits"},
+                "weekly_challenges": {"$sum": "$total_challenges_completed"},
+            }},
+        ], offset, limit)
+
+    granularity, start = window_start(window, now)
+    return _family_totals_pipeline("activity_buckets", "child_id", [
+        {"$match": {"granularity": granularity, "start": {"$gte": start}}},
+        {"$group": {
+            "_id": None,
+            "total_credits": {"$sum": "$credits"},
+            "weekly_challenges": {"$sum": "$challenges"},
+        }},
+    ], offset, limit)
+
+
+def build_raw_window_pipeline(start: Optional[datetime], offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+    """Rank families by credits of the raw completions since `start`, or of all of them.
+
+    Same rows as build_window_pipeline, read from every completion; used
+    while the rollups it relies on are still being backfilled.
+    """
+    since = [{"$match": {"$expr": {"$gte": [_completed_at_as_date(), start]}}}] if start is not None else []
+    return _family_totals_pipeline("completed_challenges", "child_id", [
+        *since,
+        {"$group": {
+            "_id": None,
+            "total_credits": {"$sum": {"$ifNull": ["$fun_credits_earned", 0]}},
+            "weekly_challenges": {"$sum": 1},
+        }},
+    ], offset, limit)
+
+
+async def compute_leaderboard(db, offset: int = 0, limit: Optional[int] = None,
+                              window: Optional[str] = None) -> List[dict]:
+    now = datetime.now(timezone.utc)
+    if window is None:
+        pipeline = build_leaderboard_pipeline(now - WEEKLY_WINDOW, offset=offset, limit=limit)
+    elif window == "all" and not await migration_done(db, CHILD_STATS_MIGRATION):
+        pipeline = build_raw_window_pipeline(None, offset=offset, limit=limit)
+    elif window != "all" and not await migration_done(db, ACTIVITY_BUCKETS_MIGRATION):
+        pipeline = build_raw_window_pipeline(window_start(window, now)[1], offset=offset, limit=limit)
+    else:
+        pipeline = build_window_pipeline(window, now, offset=offset, limit=limit)
+    rows = await db.families.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+    for i, row in enumerate(rows):
+        row["rank"] = offset + i + 1
+    return rows
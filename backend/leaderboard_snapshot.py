@@ -0,0 +1,192 @@
+import asyncio
+import bisect
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from leaderboard import WINDOWS, compute_leaderboard
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEY = "default"
+
+ENTRY_FIELDS = ("family_id", "family_name", "total_credits", "weekly_challenges", "rank")
+
+
+def snapshot_key(window: Optional[str]) -> str:
+    return window or DEFAULT_KEY
+
+
+class LeaderboardSnapshot:
+    """One immutable, ranked leaderboard.
+
+    Rows are ordered by (-total_credits, family_id), so a family's position
+    is found by bisecting on that key: O(log n) instead of a scan.
+    """
+
+    def __init__(self, key: str, version: int, built_at: datetime, rows: List[dict]):
+        self.key = key
+        self.version = version
+        self.built_at = built_at
+        self.rows = sorted(rows, key=lambda r: (-r["total_credits"], r["family_id"]))
+        for i, row in enumerate(self.rows):
+            row["rank"] = i + 1
+        self._keys = [(-r["total_credits"], r["family_id"]) for r in self.rows]
+        self._credits = {r["family_id"]: r["total_credits"] for r in self.rows}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def age(self) -> float:
+        return (datetime.now(timezone.utc) - self.built_at).total_seconds()
+
+    def page(self, offset: int = 0, limit: Optional[int] = None) -> List[dict]:
+        return self.rows[offset:offset + limit if limit is not None else None]
+
+    def position(self, family_id: str) -> Optional[int]:
+        credits = self._credits.get(family_id)
+        if credits is None:
+            return None
+        return bisect.bisect_left(self._keys, (-credits, family_id))
+
+    def around(self, family_id: str, neighbours: int) -> Optional[dict]:
+        """The family's row with up to `neighbours` rows above and below it."""
+        i = self.position(family_id)
+        if i is None:
+            return None
+        return {
+            "family": self.rows[i],
+            "above": self.rows[max(0, i - neighbours):i],
+            "below": self.rows[i + 1:i + 1 + neighbours],
+            "total_families": len(self.rows),
+        }
+
+
+class LeaderboardSnapshots:
+    """Periodically rebuilt leaderboard snapshots, shared by every worker.
+
+    One worker at a time rebuilds a snapshot (a lease on its pointer
+    document), writes its rows to `leaderboard_snapshot_entries` under a
+    new version, then moves the pointer in `leaderboard_snapshots`. Every
+    worker polls the pointers and loads newer versions. Readers only ever
+    see a complete snapshot: the new one replaces the old in one reference
+    swap, so nobody waits on a rebuild.
+    """
+
+    def __init__(self, db, interval: float = 60.0, poll_interval: float = 5.0, lease: float = 120.0,
+                 batch_size: int = 1000):
+        self.db = db
+        self.interval = timedelta(seconds=interval)
+        self.poll_interval = poll_interval
+        self.lease = timedelta(seconds=lease)
+        self.batch_size = batch_size
+        self.keys = [DEFAULT_KEY, *WINDOWS]
+        self.rebuilds = 0
+        self._snapshots: Dict[str, LeaderboardSnapshot] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, window: Optional[str]) -> Optional[LeaderboardSnapshot]:
+        return self._snapshots.get(snapshot_key(window))
+
+    async def _load(self, key: str, pointer: dict):
+        rows = await self.db.leaderboard_snapshot_entries.find(
+            {"key": key, "version": pointer["version"]}, {"_id": 0, **{field: 1 for field in ENTRY_FIELDS}}
+        ).to_list(None)
+        # The pointer only moves once every row is written, but an older
+        # version may already be gone if this worker lagged far behind
+        if len(rows) == pointer.get("size", len(rows)):
+            self._snapshots[key] = LeaderboardSnapshot(key, pointer["version"], pointer["built_at"], rows)
+
+    async def _claim(self, key: str, now: datetime) -> Optional[dict]:
+        try:
+            return await self.db.leaderboard_snapshots.find_one_and_update(
+                {"_id": key, "$and": [
+                    {"$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+                    # Someone else may have rebuilt it since the pointer was read
+                    {"$or": [{"built_at": {"$exists": False}}, {"built_at": {"$lt": now - self.interval}}]},
+                ]},
+                {"$set": {"lease_until": now + self.lease}, "$setOnInsert": {"version": 0}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Another worker holds the lease or has just rebuilt it
+            return None
+
+    async def rebuild(self, key: str):
+        now = datetime.now(timezone.utc)
+        pointer = await self._claim(key, now)
+        if pointer is None:
+            return
+        try:
+            window = None if key == DEFAULT_KEY else key
+            snapshot = LeaderboardSnapshot(key, pointer["version"] + 1, now,
+                                           await compute_leaderboard(self.db, window=window))
+            entries = [{"key": key, "version": snapshot.version, **row} for row in snapshot.rows]
+            for start in range(0, len(entries), self.batch_size):
+                await self.db.leaderboard_snapshot_entries.insert_many(entries[start:start + self.batch_size])
+            await self.db.leaderboard_snapshots.update_one(
+                {"_id": key},
+                {"$set": {"version": snapshot.version, "built_at": now, "size": len(snapshot)},
+                 "$unset": {"lease_until": ""}},
+            )
+            self._snapshots[key] = snapshot
+            self.rebuilds += 1
+            # Keep the previous version for workers that are still loading it
+            await self.db.leaderboard_snapshot_entries.delete_many(
+                {"key": key, "version": {"$lt": snapshot.version - 1}}
+            )
+        except Exception:
+            await self.db.leaderboard_snapshots.update_one({"_id": key}, {"$unset": {"lease_until": ""}})
+            raise
+
+    async def refresh(self, key: str):
+        pointer = await self.db.leaderboard_snapshots.find_one({"_id": key})
+        if pointer and pointer.get("built_at"):
+            current = self._snapshots.get(key)
+            if current is None or current.version < pointer["version"]:
+                await self._load(key, pointer)
+            if datetime.now(timezone.utc) - pointer["built_at"] < self.interval:
+                return
+        await self.rebuild(key)
+
+    async def ensure(self, window: Optional[str]) -> Optional[LeaderboardSnapshot]:
+        """The current snapshot, built on the spot if this worker has none yet."""
+        key = snapshot_key(window)
+        if key not in self._snapshots:
+            await self.refresh(key)
+        return self._snapshots.get(key)
+
+    async def run(self):
+        while True:
+            for key in self.keys:
+                try:
+                    await self.refresh(key)
+                except Exception as e:
+                    logger.error(f"Leaderboard snapshot {key} refresh failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "rebuilds": self.rebuilds,
+            "snapshots": {
+                key: {"version": s.version, "families": len(s), "age_seconds": s.age()}
+                for key, s in self._snapshots.items()
+            },
+        }
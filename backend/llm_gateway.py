@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from emergentintegrations.llm.chat import LlmChat, UserMessage
+
+from metrics import LLM_ERRORS, LLM_LATENCY, record_llm_wait
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """Base class for every failure surfaced by the gateway."""
+
+
+class ProviderUnavailable(LLMError):
+    """The provider's circuit is open, no call was attempted."""
+
+
+class ProviderTimeout(LLMError):
+    """The call did not finish before its deadline."""
+
+
+class ProviderError(LLMError):
+    """The provider call itself failed."""
+
+
+def default_chat_factory(api_key: str, session_id: str, system_message: str, provider: str, model: str):
+    return LlmChat(
+        api_key=api_key,
+        session_id=session_id,
+        system_message=system_message
+    ).with_model(provider, model)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures.
+
+    While open every call is rejected; once `reset_timeout` seconds have
+    passed a single trial call is let through (half-open) and its outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_cancelled(self):
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+
+class LLMProvider:
+    def __init__(self, name: str, provider: str, model: str, system_message: str,
+                 max_concurrency: int, timeout: float, breaker: CircuitBreaker):
+        self.name = name
+        self.provider = provider
+        self.model = model
+        self.system_message = system_message
+        self.timeout = timeout
+        self.breaker = breaker
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight: Dict[str, asyncio.Task] = {}
+        self.waiters: Dict[str, int] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.errors = 0
+
+
+class LLMGateway:
+    """Single entry point for every LLM call made by the API.
+
+    Each registered provider is long-lived and owns a concurrency semaphore,
+    a per-call deadline (which includes the time spent waiting for a slot), a
+    circuit breaker, and a table of in-flight prompts so identical concurrent
+    prompts share one upstream call.
+    """
+
+    def __init__(self, api_key: Optional[str], max_concurrency: int = 8, timeout: float = 60.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 chat_factory: Callable = default_chat_factory):
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.chat_factory = chat_factory
+        self.providers: Dict[str, LLMProvider] = {}
+
+    def register(self, name: str, provider: str, model: str, system_message: str,
+                 max_concurrency: Optional[int] = None, timeout: Optional[float] = None):
+        self.providers[name] = LLMProvider(
+            name, provider, model, system_message,
+            max_concurrency=max_concurrency or self.max_concurrency,
+            timeout=timeout or self.timeout,
+            breaker=CircuitBreaker(self.failure_threshold, self.reset_timeout),
+        )
+
+    async def send(self, name: str, prompt: str, coalesce: bool = True) -> str:
+        """Answer of provider `name` to `prompt`.
+
+        With `coalesce`, a caller sending a prompt already in flight shares
+        its answer. Pass False where each call must produce its own output,
+        such as generating several challenges from the same brief.
+        """
+        provider = self.providers[name]
+        if not coalesce:
+            if not provider.breaker.allow():
+                provider.rejected += 1
+                LLM_ERRORS.inc(provider=name, kind="circuit_open")
+                raise ProviderUnavailable(f"{name} circuit is open")
+            started = time.monotonic()
+            try:
+                return await self._call(provider, prompt)
+            finally:
+                record_llm_wait(time.monotonic() - started)
+
+        key = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+        task = provider.in_flight.get(key)
+        if task is not None:
+            provider.coalesced += 1
+        else:
+            if not provider.breaker.allow():
+                provider.rejected += 1
+                LLM_ERRORS.inc(provider=name, kind="circuit_open")
+                raise ProviderUnavailable(f"{name} circuit is open")
+            task = asyncio.create_task(self._call(provider, prompt))
+            provider.in_flight[key] = task
+
+            def forget(done):
+                if provider.in_flight.get(key) is done:
+                    del provider.in_flight[key]
+            task.add_done_callback(forget)
+
+        # Shielded so one caller going away does not cancel the shared call;
+        # the upstream call is only cancelled once every caller has gone
+        provider.waiters[key] = provider.waiters.get(key, 0) + 1
+        started = time.monotonic()
+        try:
+            return await asyncio.shield(task)
+        finally:
+            record_llm_wait(time.monotonic() - started)
+            provider.waiters[key] -= 1
+            if not provider.waiters[key]:
+                del provider.waiters[key]
+                if not task.done():
+                    provider.in_flight.pop(key, None)
+                    task.cancel()
+
+    async def _call(self, provider: LLMProvider, prompt: str) -> str:
+        provider.calls += 1
+        started = time.monotonic()
+        try:
+            response = await asyncio.wait_for(self._send(provider, prompt), timeout=provider.timeout)
+        except asyncio.CancelledError:
+            provider.breaker.record_cancelled()
+            LLM_LATENCY.observe(time.monotonic() - started, provider=provider.name, outcome="cancelled")
+            raise
+        except asyncio.TimeoutError:
+            provider.timeouts += 1
+            provider.breaker.record_failure()
+            LLM_LATENCY.observe(time.monotonic() - started, provider=provider.name, outcome="timeout")
+            LLM_ERRORS.inc(provider=provider.name, kind="timeout")
+            raise ProviderTimeout(f"{provider.name} did not answer within {provider.timeout}s")
+        except Exception as e:
+            provider.errors += 1
+            provider.breaker.record_failure()
+            LLM_LATENCY.observe(time.monotonic() - started, provider=provider.name, outcome="error")
+            LLM_ERRORS.inc(provider=provider.name, kind="error")
+            raise ProviderError(f"{provider.name} call failed: {e}") from e
+        provider.breaker.record_success()
+        LLM_LATENCY.observe(time.monotonic() - started, provider=provider.name, outcome="ok")
+        return response
+
+    async def _send(self, provider: LLMProvider, prompt: str) -> str:
+        async with provider.semaphore:
+            # LlmChat keeps the conversation of its session, so every call gets
+            # its own session instead of sharing one across users
+            chat = self.chat_factory(
+                self.api_key,
+                f"{provider.name}-{uuid.uuid4()}",
+                provider.system_message,
+                provider.provider,
+                provider.model,
+            )
+            return await chat.send_message(UserMessage(text=prompt))
+
+    def stats(self) -> dict:
+        return {
+            name: {
+                "provider": p.provider,
+                "model": p.model,
+                "circuit": p.breaker.state,
+                "in_flight": len(p.in_flight),
+                "max_concurrency": p.max_concurrency,
+                "calls": p.calls,
+                "coalesced": p.coalesced,
+                "rejected": p.rejected,
+                "timeouts": p.timeouts,
+                "errors": p.errors,
+            }
+            for name, p in self.providers.items()
+        }
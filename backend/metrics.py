@@ -0,0 +1,294 @@
+import bisect
+import contextvars
+import inspect
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[Tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self.values[tuple(labels[name] for name in self.labelnames)] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+HTTP_REQUESTS = Counter("off_http_requests_total", "HTTP requests by route and status",
+                        ("method", "route", "status"))
+HTTP_LATENCY = Histogram("off_http_request_duration_seconds", "HTTP request latency by route",
+                         ("method", "route"))
+REQUEST_DB_OPS = Histogram("off_http_request_db_operations", "MongoDB operations made by one request",
+                           ("method", "route"), COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram("off_http_request_db_seconds", "Time one request spent waiting on MongoDB",
+                            ("method", "route"))
+DB_OPS = Counter("off_db_operations_total", "MongoDB operations by collection and method",
+                 ("collection", "operation"))
+DB_LATENCY = Histogram("off_db_operation_duration_seconds", "MongoDB operation latency",
+                       ("collection", "operation"))
+LLM_LATENCY = Histogram("off_llm_call_duration_seconds", "Upstream LLM call latency by provider and outcome",
+                        ("provider", "outcome"))
+LLM_ERRORS = Counter("off_llm_errors_total", "LLM calls that failed, by provider and kind",
+                     ("provider", "kind"))
+LLM_FALLBACKS = Counter("off_llm_fallbacks_total", "Responses served without the LLM, by provider and reason",
+                        ("provider", "reason"))
+
+REGISTRY = [HTTP_REQUESTS, HTTP_LATENCY, REQUEST_DB_OPS, REQUEST_DB_TIME, DB_OPS, DB_LATENCY,
+            LLM_LATENCY, LLM_ERRORS, LLM_FALLBACKS]
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    def __init__(self):
+        self.db_ops = 0
+        self.db_seconds = 0.0
+        self.llm_seconds = 0.0
+        self.breakdown: Dict[str, list] = defaultdict(lambda: [0, 0.0])
+
+    def record_db(self, collection: str, operation: str, seconds: float, new_op: bool):
+        entry = self.breakdown[f"{collection}.{operation}"]
+        if new_op:
+            self.db_ops += 1
+            entry[0] += 1
+        self.db_seconds += seconds
+        entry[1] += seconds
+
+    def describe(self) -> str:
+        return ", ".join(f"{name} x{count} {seconds * 1000:.1f}ms"
+                         for name, (count, seconds) in sorted(self.breakdown.items(), key=lambda i: -i[1][1]))
+
+
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def record_db(collection: str, operation: str, seconds: float, new_op: bool = True,
+              total_seconds: Optional[float] = None):
+    """Account `seconds` of waiting on MongoDB to the current request.
+
+    `total_seconds` is the operation's full latency, given once it is over.
+    """
+    if new_op:
+        DB_OPS.inc(collection=collection, operation=operation)
+    if total_seconds is not None:
+        DB_LATENCY.observe(total_seconds, collection=collection, operation=operation)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.record_db(collection, operation, seconds, new_op)
+
+
+def record_llm_wait(seconds: float):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.llm_seconds += seconds
+
+
+class InstrumentedCursor:
+    """Times a Motor cursor; counts one operation per query, not per batch."""
+
+    def __init__(self, cursor, collection: str, operation: str):
+        self._cursor = cursor
+        self._collection = collection
+        self._operation = operation
+        self._started = False
+        self._seconds = 0.0
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if not callable(attr):
+            return attr
+
+        def chained(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            # sort(), limit(), batch_size()... return the cursor itself
+            return self if result is self._cursor else result
+        return chained
+
+    def _record(self, seconds: float, finished: bool):
+        self._seconds += seconds
+        record_db(self._collection, self._operation, seconds, new_op=not self._started,
+                  total_seconds=self._seconds if finished else None)
+        self._started = True
+
+    async def to_list(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.to_list(*args, **kwargs)
+        finally:
+            self._record(time.perf_counter() - started, finished=True)
+
+    def __aiter__(self):
+        self._iterator = self._cursor.__aiter__()
+        return self
+
+    async def __anext__(self):
+        started = time.perf_counter()
+        finished = False
+        try:
+            return await self._iterator.__anext__()
+        except StopAsyncIteration:
+            finished = True
+            raise
+        finally:
+            self._record(time.perf_counter() - started, finished)
+
+
+class InstrumentedCollection:
+    def __init__(self, collection):
+        self._collection = collection
+        self._name = collection.name
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if inspect.isawaitable(result):
+                return self._timed(name, result)
+            if hasattr(result, "to_list"):
+                return InstrumentedCursor(result, self._name, name)
+            return result
+        return call
+
+    async def _timed(self, operation: str, awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            elapsed = time.perf_counter() - started
+            record_db(self._name, operation, elapsed, total_seconds=elapsed)
+
+
+class InstrumentedDatabase:
+    """Wraps the Motor database so every collection call is counted and timed."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def _wrap(self, attr):
+        # Collections are the attributes that can be queried
+        return InstrumentedCollection(attr) if hasattr(attr, "find_one") else attr
+
+    def __getattr__(self, name):
+        return self._wrap(getattr(self._db, name))
+
+    def __getitem__(self, name):
+        return self._wrap(self._db[name])
+
+
+class MetricsMiddleware:
+    """Records latency and database usage per route template.
+
+    Requests slower than `slow_request_ms` are logged with their breakdown.
+    """
+
+    def __init__(self, app, slow_request_ms: Optional[float] = None):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_stats.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label so they cannot blow up cardinality
+            template = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            HTTP_REQUESTS.inc(method=method, route=template, status=status)
+            HTTP_LATENCY.observe(elapsed, method=method, route=template)
+            REQUEST_DB_OPS.observe(stats.db_ops, method=method, route=template)
+            REQUEST_DB_TIME.observe(stats.db_seconds, method=method, route=template)
+            if self.slow_request_ms is not None and elapsed * 1000 >= self.slow_request_ms:
+                logger.warning(f"Slow request {method} {template} {status}: {elapsed * 1000:.1f}ms, "
+                               f"{stats.db_ops} db ops {stats.db_seconds * 1000:.1f}ms, "
+                               f"llm {stats.llm_seconds * 1000:.1f}ms [{stats.describe()}]")
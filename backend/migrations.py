@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+DATETIMES_MIGRATION = "native_datetimes"
+# Backfills of data maintained on write, for what was written before
+CHILD_STATS_MIGRATION = "child_stats_backfill"
+ACTIVITY_BUCKETS_MIGRATION = "activity_buckets_backfill"
+
+# Timestamp fields that older code stored as ISO strings
+DATETIME_FIELDS = {
+    "children": ["created_at"],
+    "challenges": ["created_at"],
+    "families": ["created_at"],
+    "completed_challenges": ["completed_at"],
+}
+
+LEASE = timedelta(seconds=60)
+
+
+def parse_datetime(value) -> Optional[datetime]:
+    """Read a timestamp stored either as an ISO string or a BSON date, as aware UTC."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+async def _acquire_lease(db, name: str, owner: str, initial: dict) -> Optional[dict]:
+    # Only one worker migrates at a time; a dead worker's lease simply expires
+    now = datetime.now(timezone.utc)
+    state = await db.migrations.find_one({"_id": name})
+    if state is None:
+        await db.migrations.update_one({"_id": name}, {"$setOnInsert": {"done": False, **initial}}, upsert=True)
+    return await db.migrations.find_one_and_update(
+        {
+            "_id": name,
+            "done": False,
+            "$or": [{"owner": owner}, {"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}],
+        },
+        {"$set": {"owner": owner, "lease_until": now + LEASE}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def migrate_datetimes(db, batch_size: int = 500, pause: float = 0.05) -> Optional[dict]:
+    """Rewrite string timestamps as native dates, one `_id`-ordered batch at a time.
+
+    Progress is checkpointed after every batch so an interrupted run resumes
+    where it stopped. Each update only applies if the field still holds the
+    string that was read, so concurrent writes are never overwritten.
+    Returns the final migration state, or None if another worker holds it.
+    """
+    owner = str(uuid.uuid4())
+    state = await _acquire_lease(db, DATETIMES_MIGRATION, owner,
+                                 {"checkpoints": {}, "converted": 0, "unparseable": 0})
+    if state is None:
+        return None
+
+    for collection, fields in DATETIME_FIELDS.items():
+        last_id = state.get("checkpoints", {}).get(collection)
+        while True:
+            query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            docs = await db[collection].find(query, {field: 1 for field in fields}) \
+                .sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+
+            operations = []
+            unparseable = 0
+            for doc in docs:
+                for field in fields:
+                    if not isinstance(doc.get(field), str):
+                        continue
+                    value = parse_datetime(doc[field])
+                    if value is None:
+                        unparseable += 1
+                        continue
+                    operations.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: value}}))
+            if operations:
+                await db[collection].bulk_write(operations, ordered=False)
+
+            last_id = docs[-1]["_id"]
+            state = await db.migrations.find_one_and_update(
+                {"_id": DATETIMES_MIGRATION, "owner": owner},
+                {
+                    "$set": {
+                        f"checkpoints.{collection}": last_id,
+                        "lease_until": datetime.now(timezone.utc) + LEASE,
+                    },
+                    "$inc": {"converted": len(operations), "unparseable": unparseable},
+                },
+                return_document=ReturnDocument.AFTER,
+            )
+            if state is None:
+                logger.warning("Datetime migration lease lost, stopping")
+                return None
+            # Leave room for live traffic between batches
+            await asyncio.sleep(pause)
+
+    return await db.migrations.find_one_and_update(
+        {"_id": DATETIMES_MIGRATION, "owner": owner},
+        {"$set": {"done": True, "finished_at": datetime.now(timezone.utc)}, "$unset": {"lease_until": ""}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+_finished = set()
+
+
+async def migration_done(db, name: str) -> bool:
+    """Whether the migration has finished; once it has, this worker stops asking."""
+    if name not in _finished:
+        if not await db.migrations.find_one({"_id": name, "done": True}, {"_id": 1}):
+            return False
+        _finished.add(name)
+    return True
+
+
+async def backfill_children(db, name: str, backfill: Callable[[object, List[str]], Awaitable[None]],
+                            batch_size: int = 200, pause: float = 0.05) -> Optional[dict]:
+    """Run `backfill` over every child id, one `_id`-ordered batch at a time.
+
+    Leased and checkpointed like migrate_datetimes, so an interrupted run
+    resumes where it stopped; `backfill` must be safe to run twice on a batch.
+    Returns the final migration state, or None if another worker holds it.
+    """
+    owner = str(uuid.uuid4())
+    state = await _acquire_lease(db, name, owner, {"processed": 0})
+    if state is None:
+        return None
+
+    last_id = state.get("checkpoint")
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        docs = await db.children.find(query, {"_id": 1, "id": 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        await backfill(db, [doc["id"] for doc in docs])
+        last_id = docs[-1]["_id"]
+        state = await db.migrations.find_one_and_update(
+            {"_id": name, "owner": owner},
+            {"$set": {"checkpoint": last_id, "lease_until": datetime.now(timezone.utc) + LEASE},
+             "$inc": {"processed": len(docs)}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if state is None:
+            logger.warning(f"Migration {name} lease lost, stopping")
+            return None
+        await asyncio.sleep(pause)
+
+    return await db.migrations.find_one_and_update(
+        {"_id": name, "owner": owner},
+        {"$set": {"done": True, "finished_at": datetime.now(timezone.utc)}, "$unset": {"lease_until": ""}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def run_datetime_migration(db):
+    try:
+        state = await migrate_datetimes(db)
+        if state:
+            logger.info(f"Datetime migration finished: {state.get('converted', 0)} fields converted, "
+                        f"{state.get('unparseable', 0)} left unparseable")
+    except Exception as e:
+        logger.error(f"Datetime migration stopped: {e}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Convert string timestamps to native BSON dates")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to sleep between batches")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    try:
+        state = await migrate_datetimes(client[os.environ['DB_NAME']], args.batch_size, args.pause)
+        print(state if state else "Another worker is running the migration")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
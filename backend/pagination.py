@@ -0,0 +1,49 @@
+from typing import Callable, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Page size of the JSON list endpoints when no `limit` is given
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 1000
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def keyset_query(query: dict, after: Optional[str]) -> dict:
+    """Restrict `query` to documents whose `id` sorts after the cursor."""
+    if after is None:
+        return query
+    return {**query, "id": {"$gt": after}}
+
+
+async def fetch_page(collection, query: dict, fields: dict, after: Optional[str],
+                     limit: int) -> Tuple[List[dict], Optional[str]]:
+    """Return one page ordered by `id` and the cursor of the next page, if any.
+
+    One extra document is read to know whether another page exists, so the
+    cursor is only returned when there is something left to fetch.
+    """
+    docs = await collection.find(keyset_query(query, after), fields) \
+        .sort("id", 1).limit(limit + 1).to_list(limit + 1)
+    next_cursor = docs[limit - 1]["id"] if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+
+def stream_ndjson(collection, query: dict, fields: dict, after: Optional[str], limit: Optional[int],
+                  batch_size: int, serialize: Callable[[dict], bytes]) -> StreamingResponse:
+    """Stream matching documents one JSON line at a time straight off the cursor."""
+    cursor = collection.find(keyset_query(query, after), fields).sort("id", 1).batch_size(batch_size)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    async def lines():
+        async for doc in cursor:
+            yield serialize(doc) + b"\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
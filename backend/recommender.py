@@ -0,0 +1,199 @@
+import hashlib
+import re
+import unicodedata
+from itertools import islice
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from stats_rollup import category_key
+
+# Width of the hashed bag-of-words vectors
+FEATURE_DIM = 512
+
+# Weights of the relevance score
+INTEREST_WEIGHT = 1.0
+CATEGORY_WEIGHT = 0.6
+RECENT_WEIGHT = 0.4
+
+# Diversity: 1.0 ranks by relevance only, lower values favour variety
+MMR_LAMBDA = 0.7
+# Subtracted again for every pick already made in the same category
+CATEGORY_REPEAT_PENALTY = 0.1
+# Candidates the diversity pass chooses from, per requested item
+CANDIDATES_PER_ITEM = 10
+# Candidates this similar to a pick, or with the same title, are the same challenge
+DUPLICATE_SIMILARITY = 0.98
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokens(text: str) -> List[str]:
+    # Accents are folded so "écran" and "ecran" hash to the same feature
+    folded = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    return [word for word in _WORD.findall(folded) if len(word) > 2]
+
+
+def hashed_features(words: Iterable[str], dim: int = FEATURE_DIM) -> np.ndarray:
+    """L2-normalised hashed bag of words."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in words:
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest, "little") % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def title_key(title: str) -> int:
+    digest = hashlib.blake2b(" ".join(tokens(title or "")).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+def challenge_words(doc: dict) -> List[str]:
+    # The category counts twice so it weighs more than any single word
+    category = doc.get("category") or ""
+    return tokens(f"{doc.get('title', '')} {doc.get('description', '')} {category} {category}")
+
+
+class ChallengeRecommender:
+    """Scores the whole challenge catalog for one child with NumPy.
+
+    One row per challenge: hashed text features, age bounds and category.
+    Rows are appended as the in-memory catalog grows and rebuilt when the
+    catalog does a full reload, so a request only pays for the scoring.
+    Challenges generated for one child (`generated_for`) are left out.
+    """
+
+    def __init__(self, dim: int = FEATURE_DIM):
+        self.dim = dim
+        self.generation = None
+        # Catalog documents already looked at, added or not
+        self.synced = 0
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.categories: List[str] = []
+        self._category_index: Dict[str, int] = {}
+        self._capacity = 0
+        self._features = np.zeros((0, dim), dtype=np.float32)
+        self._age_min = np.zeros(0, dtype=np.int32)
+        self._age_max = np.zeros(0, dtype=np.int32)
+        self._category = np.zeros(0, dtype=np.int32)
+        self._title = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _grow(self, needed: int):
+        if needed <= self._capacity:
+            return
+        capacity = max(needed, self._capacity * 2, 1024)
+        features = np.zeros((capacity, self.dim), dtype=np.float32)
+        features[:len(self.ids)] = self._features[:len(self.ids)]
+        self._features = features
+        for name in ("_age_min", "_age_max", "_category", "_title"):
+            column = np.zeros(capacity, dtype=getattr(self, name).dtype)
+            column[:len(self.ids)] = getattr(self, name)[:len(self.ids)]
+            setattr(self, name, column)
+        self._capacity = capacity
+
+    def _category_of(self, category: Optional[str]) -> int:
+        key = category_key(category)
+        if key not in self._category_index:
+            self._category_index[key] = len(self.categories)
+            self.categories.append(key)
+        return self._category_index[key]
+
+    def add(self, docs: List[dict]):
+        docs = [doc for doc in docs if doc["id"] not in self.rows and not doc.get("generated_for")]
+        if not docs:
+            return
+        start = len(self.ids)
+        self._grow(start + len(docs))
+        for row, doc in enumerate(docs, start=start):
+            age_range = doc.get("age_range") or [0, 200]
+            self._features[row] = hashed_features(challenge_words(doc), self.dim)
+            self._age_min[row], self._age_max[row] = age_range[0], age_range[-1]
+            self._category[row] = self._category_of(doc.get("category"))
+            self._title[row] = title_key(doc.get("title"))
+            self.rows[doc["id"]] = row
+            self.ids.append(doc["id"])
+
+    def sync(self, catalog):
+        """Catch up with the catalog: append new challenges, rebuild after a full reload."""
+        if catalog.generation != self.generation:
+            self.__init__(self.dim)
+            self.generation = catalog.generation
+        if len(catalog) > self.synced:
+            # The catalog only appends between full reloads, new challenges are at the end
+            docs = list(islice(catalog.documents(), self.synced, None))
+            self.synced += len(docs)
+            self.add(docs)
+
+    def recommend(self, age: int, interests: List[str], category_counts: Dict[str, int],
+                  recent_ids: List[str], exclude_ids: Iterable[str], limit: int,
+                  category: Optional[str] = None) -> List[str]:
+        """Ids of the `limit` best challenges for the child, varied, best first."""
+        n = len(self.ids)
+        if not n:
+            return []
+        features = self._features[:n]
+
+        eligible = (self._age_min[:n] <= age) & (self._age_max[:n] >= age)
+        if category is not None:
+            wanted = self._category_index.get(category_key(category))
+            eligible &= self._category[:n] == (wanted if wanted is not None else -1)
+        excluded = [self.rows[i] for i in exclude_ids if i in self.rows]
+        eligible[excluded] = False
+        candidates = np.flatnonzero(eligible)
+        if not len(candidates):
+            return []
+
+        cand_features = features[candidates]
+        score = np.zeros(len(candidates), dtype=np.float32)
+        if interests:
+            score += INTEREST_WEIGHT * (cand_features @ hashed_features(tokens(" ".join(interests)), self.dim))
+
+        # Share of the child's completions in each challenge's category
+        total = sum(category_counts.values())
+        if total:
+            affinity = np.zeros(len(self.categories), dtype=np.float32)
+            for key, count in category_counts.items():
+                if key in self._category_index:
+                    affinity[self._category_index[key]] = count / total
+            score += CATEGORY_WEIGHT * affinity[self._category[candidates]]
+
+        recent_rows = [self.rows[i] for i in recent_ids if i in self.rows]
+        if recent_rows:
+            taste = features[recent_rows].mean(axis=0)
+            norm = np.linalg.norm(taste)
+            if norm:
+                score += RECENT_WEIGHT * (cand_features @ (taste / norm))
+
+        # Shortlist the best overall plus the best of every category, so the
+        # diversity pass can still reach categories the child rarely does
+        cand_categories = self._category[candidates]
+        shortlist_size = min(len(candidates), limit * CANDIDATES_PER_ITEM)
+        best_overall = np.argpartition(-score, shortlist_size - 1)[:shortlist_size]
+        by_category = np.lexsort((-score, cand_categories))
+        sorted_categories = cand_categories[by_category]
+        rank_in_category = np.arange(len(by_category)) - np.searchsorted(sorted_categories, sorted_categories)
+        shortlist = np.union1d(best_overall, by_category[rank_in_category < limit])
+        shortlist = shortlist[np.argsort(-score[shortlist], kind="stable")]
+        vectors = cand_features[shortlist]
+        categories = cand_categories[shortlist]
+        titles = self._title[candidates[shortlist]]
+        relevance = score[shortlist]
+        redundancy = np.zeros(len(shortlist), dtype=np.float32)
+        repeats = np.zeros(len(shortlist), dtype=np.float32)
+        available = np.ones(len(shortlist), dtype=bool)
+        picked = []
+        while len(picked) < limit and available.any():
+            mmr = MMR_LAMBDA * relevance - (1 - MMR_LAMBDA) * redundancy - CATEGORY_REPEAT_PENALTY * repeats
+            best = int(np.argmax(np.where(available, mmr, -np.inf)))
+            picked.append(best)
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+            repeats += categories == categories[best]
+            # Copies of the pick, such as the same fallback saved twice, are never shown again
+            available &= (redundancy < DUPLICATE_SIMILARITY) & (titles != titles[best])
+            available[best] = False
+        return [self.ids[candidates[shortlist[i]]] for i in picked]
@@ -0,0 +1,39 @@
+import json
+from datetime import datetime
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional, the stdlib encoder is the fallback
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat().replace("+00:00", "Z")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """Encode trusted database rows; datetimes come out as ISO 8601 with a Z suffix."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when it is installed.
+
+    Returning it directly from a route also skips FastAPI's response_model
+    validation, which read routes rely on to serialize projected database
+    rows without building a Pydantic model per document.
+    """
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def projection(model) -> dict:
+    """Mongo projection of exactly the fields `model` returns."""
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
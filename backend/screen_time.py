@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from activity_buckets import DAY, WEEK, as_utc, bucket_start
+
+logger = logging.getLogger(__name__)
+
+SCREEN = "screen"
+REAL = "real"
+
+# Field of the daily bucket and of the family document, by kind of minutes
+DAILY_FIELDS = {SCREEN: "screen_minutes", REAL: "real_minutes"}
+WEEKLY_FIELDS = {SCREEN: "weekly_screen_time", REAL: "weekly_real_time"}
+
+
+def weekly_update(week, minutes: Dict[str, int]) -> List[dict]:
+    """Pipeline update adding `minutes` to a family's totals for `week`.
+
+    The totals restart from zero when `week` is newer than the one they
+    hold; minutes reported late for an older week leave them unchanged.
+    """
+    current = {"$eq": ["$screen_time_week", week]}
+    # null sorts before any date, so a family without a week counts as older
+    newer = {"$gt": [week, {"$ifNull": ["$screen_time_week", None]}]}
+    fields = {}
+    for kind, field in WEEKLY_FIELDS.items():
+        added = minutes.get(kind, 0)
+        fields[field] = {"$switch": {
+            "branches": [
+                {"case": current, "then": {"$add": [{"$ifNull": [f"${field}", 0]}, added]}},
+                {"case": newer, "then": added},
+            ],
+            "default": f"${field}",
+        }}
+    fields["screen_time_week"] = {"$cond": [newer, week, "$screen_time_week"]}
+    return [{"$set": fields}]
+
+
+class ScreenTimeIngestor:
+    """Buffers screen-time events in memory and writes them in batches.
+
+    Events are summed per (child, UTC day) as they arrive, so the buffer
+    grows with the number of active children rather than with the number
+    of events. A flush, every `flush_interval` seconds or as soon as
+    `max_events` are pending, writes one $inc upsert per daily bucket and
+    one update per family and ISO week for the weekly totals.
+
+    The daily buckets are the record: minutes whose bucket write fails go
+    back into the buffer for the next flush, while a failed family update
+    is only logged. Events still buffered when a worker dies are lost.
+
+    Only events measured between `max_age_days` ago and `max_clock_skew`
+    seconds from now are accepted: a single event from a device clock set
+    in the future would otherwise move a family's week ahead and freeze
+    its weekly totals until that date.
+    """
+
+    def __init__(self, db, flush_interval: float = 1.0, max_events: int = 50000,
+                 on_families_updated: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+                 known_children_size: int = 100000, max_clock_skew: float = 300.0, max_age_days: int = 31):
+        self.db = db
+        self.max_clock_skew = timedelta(seconds=max_clock_skew)
+        self.max_age = timedelta(days=max_age_days)
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self.on_families_updated = on_families_updated
+        self.known_children_size = known_children_size
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds = 0.0
+        # (child_id, day) -> {kind: minutes}
+        self._pending: Dict[Tuple[str, object], Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._pending_events = 0
+        self._known_children: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def unknown_children(self, child_ids: Iterable[str]) -> List[str]:
+        """Ids that are not children; known ones are remembered, children are never deleted."""
+        missing = [child_id for child_id in dict.fromkeys(child_ids) if child_id not in self._known_children]
+        if not missing:
+            return []
+        found = await self.db.children.find({"id": {"$in": missing}}, {"_id": 0, "id": 1}).to_list(None)
+        for child in found:
+            self._known_children[child["id"]] = None
+        while len(self._known_children) > self.known_children_size:
+            self._known_children.popitem(last=False)
+        found_ids = {child["id"] for child in found}
+        return [child_id for child_id in missing if child_id not in found_ids]
+
+    def accepts(self, at: datetime, now: Optional[datetime] = None) -> bool:
+        now = now or datetime.now(timezone.utc)
+        return now - self.max_age <= as_utc(at) <= now + self.max_clock_skew
+
+    def add(self, events: Iterable[dict]) -> int:
+        count = 0
+        for event in events:
+            self._pending[(event["child_id"], bucket_start(DAY, event["at"]))][event["kind"]] += event["minutes"]
+            count += 1
+        self.received += count
+        self._pending_events += count
+        if self._pending_events >= self.max_events:
+            self._wake.set()
+        return count
+
+    def _restore(self, items: List[tuple]):
+        for key, minutes in items:
+            for kind, value in minutes.items():
+                self._pending[key][kind] += value
+        self._pending_events += len(items)
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            items, events = list(self._pending.items()), self._pending_events
+            self._pending, self._pending_events = defaultdict(lambda: defaultdict(int)), 0
+            started = time.perf_counter()
+            try:
+                await self.db.screen_time_daily.bulk_write([
+                    UpdateOne(
+                        {"child_id": child_id, "day": day},
+                        {"$inc": {DAILY_FIELDS[kind]: value for kind, value in minutes.items()}},
+                        upsert=True,
+                    )
+                    for (child_id, day), minutes in items
+                ], ordered=False)
+            except BulkWriteError as e:
+                # Only the buckets that were not written go back, the others must not count twice
+                failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                self.failed_flushes += 1
+                self._restore([item for i, item in enumerate(items) if i in failed])
+                raise
+            except Exception:
+                self.failed_flushes += 1
+                self._restore(items)
+                raise
+            self.flushes += 1
+            self.written += events
+            try:
+                family_ids = await self._update_families(items)
+            finally:
+                self.last_flush_seconds = time.perf_counter() - started
+        if family_ids and self.on_families_updated is not None:
+            await self.on_families_updated(family_ids)
+
+    async def _update_families(self, items: List[tuple]) -> List[str]:
+        """Add the minutes to each family's weekly totals, one update per family and week."""
+        child_ids = list({child_id for (child_id, _), _ in items})
+        families = await self.db.families.find(
+            {"children": {"$in": child_ids}}, {"_id": 0, "id": 1, "children": 1}
+        ).to_list(None)
+        families_of = defaultdict(list)
+        for family in families:
+            for child_id in family.get("children", []):
+                families_of[child_id].append(family["id"])
+        weekly = defaultdict(lambda: defaultdict(int))
+        for (child_id, day), minutes in items:
+            for family_id in families_of.get(child_id, []):
+                for kind, value in minutes.items():
+                    weekly[(family_id, bucket_start(WEEK, day))][kind] += value
+        if weekly:
+            # Ordered and oldest week first, so a later week resets the totals last
+            await self.db.families.bulk_write([
+                UpdateOne({"id": family_id}, weekly_update(week, minutes))
+                for (family_id, week), minutes in sorted(weekly.items(), key=lambda item: item[0][1])
+            ], ordered=True)
+        return list({family_id for family_id, _ in weekly})
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Screen time flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Write what is still buffered before the worker exits
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Screen time final flush failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "written": self.written,
+            "pending_events": self._pending_events,
+            "pending_buckets": len(self._pending),
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+        }
@@ -1,26 +1,70 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Query, Request, Response, WebSocket
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import json
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+from datetime import datetime, timedelta, timezone
+from activity_buckets import record_activity
+from catalog import ChallengeCatalog
+from catalog_import import import_challenges, parse_rows
+from challenge_cache import ChallengeMetadataCache
+from challenge_pool import NAME_PLACEHOLDER, ChallengePool, fill_template
+from coaching_cache import CoachingCache, coaching_digest
+from events import EventBus, LocalBroker, MongoBroker
+from indexes import ensure_indexes, run_diagnostics
+from jobs import FINISHED as JOB_FINISHED, JobQueue, PermanentJobError
+from leaderboard import compute_leaderboard
+from leaderboard_snapshot import LeaderboardSnapshots
+from llm_gateway import LLMError, LLMGateway
+from metrics import (
+    LLM_FALLBACKS, PROMETHEUS_MEDIA_TYPE, InstrumentedDatabase, MetricsMiddleware, render_metrics,
+)
+from migrations import parse_datetime, run_datetime_migration
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, fetch_page, stream_ndjson, wants_ndjson,
+)
+from recommender import ChallengeRecommender
+from responses import FastJSONResponse, dumps, projection
+from screen_time import REAL, SCREEN, ScreenTimeIngestor
+from sse import event_stream_response, format_event, wants_event_stream
+from stats_rollup import ROLLED_UP, apply_completions, run_activity_backfill, run_child_stats_backfill
+from versions import VersionRegistry, etag_matches
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+# Every collection call is counted and timed for /api/metrics
+db = InstrumentedDatabase(client[os.environ['DB_NAME']])
+
+# Immutable challenge metadata (category, fun_credits, age_range) by id
+challenge_cache = ChallengeMetadataCache(maxsize=int(os.environ.get('CHALLENGE_CACHE_SIZE', 10000)))
+
+# Coaching advice keyed on a digest of the family's coaching input
+coaching_cache = CoachingCache(db, max_age=float(os.environ.get('COACHING_CACHE_MAX_AGE', 86400)))
+
+# Version counters behind the ETags of the read routes
+versions = VersionRegistry(db, ttl=float(os.environ.get('VERSION_CACHE_TTL', 1)))
+
+# Live updates; EVENT_BROKER=mongo shares them between workers through a capped collection
+event_bus = EventBus(
+    MongoBroker(db) if os.environ.get('EVENT_BROKER', 'local') == 'mongo' else LocalBroker(),
+    queue_size=int(os.environ.get('LIVE_QUEUE_SIZE', 100)),
+)
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -28,26 +72,31 @@ api_router = APIRouter(prefix="/api")
 # LLM integrations
 EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY')
 
-def get_gpt5_chat():
-    return LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id="challenge_generator",
-        system_message="Tu es Nimo, la mascotte OFF qui aide les enfants à découvrir des aventures déconnectées ! Tu créés des défis personnalisés, créatifs et amusants qui utilisent le prénom de l'enfant pour rendre l'activité plus engageante. Ton ton est positif, encourageant et jamais moralisateur. Tu dis 'viens jouer dehors, ça va être génial !' plutôt que 'il faut couper les écrans'. Réponds toujours en français avec enthousiasme."
-    ).with_model("openai", "gpt-5")
-
-def get_claude4_chat():
-    return LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id="family_coach",
-        system_message="Tu es un coach familial spécialisé dans la dynamique familiale et l'équilibre numérique. Tu aides les familles à créer des liens plus forts et à développer de saines habitudes numériques. Réponds toujours en français."
-    ).with_model("anthropic", "claude-4-sonnet-20250514")
-
-def get_gemini_chat():
-    return LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id="education_advisor",
-        system_message="Tu es un conseiller pédagogique spécialisé dans les activités éducatives et familiales. Tu recommandes des activités enrichissantes et appropriées pour chaque âge. Réponds toujours en français."
-    ).with_model("gemini", "gemini-2.5-pro")
+llm_gateway = LLMGateway(
+    EMERGENT_LLM_KEY,
+    max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 8)),
+    timeout=float(os.environ.get('LLM_TIMEOUT_SECONDS', 60)),
+    failure_threshold=int(os.environ.get('LLM_BREAKER_FAILURES', 5)),
+    reset_timeout=float(os.environ.get('LLM_BREAKER_RESET_SECONDS', 30)),
+)
+
+llm_gateway.register(
+    "challenge_generator", "openai", "gpt-5",
+    system_message="Tu es Nimo, la mascotte OFF qui aide les enfants à découvrir des aventures déconnectées ! Tu créés des défis personnalisés, créatifs et amusants qui utilisent le prénom de l'enfant pour rendre l'activité plus engageante. Ton ton est positif, encourageant et jamais moralisateur. Tu dis 'viens jouer dehors, ça va être génial !' plutôt que 'il faut couper les écrans'. Réponds toujours en français avec enthousiasme."
+)
+
+llm_gateway.register(
+    "family_coach", "anthropic", "claude-4-sonnet-20250514",
+    system_message="Tu es un coach familial spécialisé dans la dynamique familiale et l'équilibre numérique. Tu aides les familles à créer des liens plus forts et à développer de saines habitudes numériques. Réponds toujours en français."
+)
+
+llm_gateway.register(
+    "education_advisor", "gemini", "gemini-2.5-pro",
+    system_message="Tu es un conseiller pédagogique spécialisé dans les activités éducatives et familiales. Tu recommandes des activités enrichissantes et appropriées pour chaque âge. Réponds toujours en français."
+)
+
+# Upper bound of a family plan, keeps the single LLM answer reasonably short
+MAX_PLAN_CHALLENGES_PER_CHILD = 7
 
 # Define Models
 class Child(BaseModel):
@@ -68,6 +117,7 @@ class Challenge(BaseModel):
     fun_credits: int
     difficulty: str  # easy, medium, hard
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    generated_for: Optional[str] = None  # id of the child it was generated for
 
 class CompletedChallenge(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -84,6 +134,7 @@ class Family(BaseModel):
     total_fun_credits: int = 0
     weekly_screen_time: int = 0  # minutes
     weekly_real_time: int = 0   # minutes  
+    screen_time_week: Optional[datetime] = None  # ISO week the weekly totals cover
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Leaderboard(BaseModel):
@@ -93,6 +144,12 @@ class Leaderboard(BaseModel):
     weekly_challenges: int
     rank: int
 
+class FamilyRank(BaseModel):
+    family: Leaderboard
+    above: List[Leaderboard]
+    below: List[Leaderboard]
+    total_families: int
+
 # Input Models
 class ChildCreate(BaseModel):
     name: str
@@ -121,21 +178,91 @@ class GenerateChallengeRequest(BaseModel):
     child_id: str
     category: Optional[str] = None
 
+class FamilyPlanRequest(BaseModel):
+    challenges_per_child: int = Field(3, ge=1, le=MAX_PLAN_CHALLENGES_PER_CHILD)
+    category: Optional[str] = None
+
+class ChildPlan(BaseModel):
+    child_id: str
+    child_name: str
+    challenges: List[Challenge]
+
+class FamilyPlan(BaseModel):
+    family_id: str
+    plans: List[ChildPlan]
+    generated: int
+    fallbacks: int
+
+class Job(BaseModel):
+    id: str
+    kind: str  # generate_challenge, family_coaching
+    status: str  # pending, running, done, failed
+    attempts: int = 0
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+class BatchCompletionResult(BaseModel):
+    index: int
+    status: str  # created, error
+    completed: Optional[CompletedChallenge] = None
+    error: Optional[str] = None
+
+class ScreenTimeEvent(BaseModel):
+    child_id: str
+    at: datetime  # when the minutes were measured
+    minutes: int = Field(1, ge=1, le=60)
+    kind: str = Field(SCREEN, pattern=f"^({SCREEN}|{REAL})$")
+
+class ScreenTimeIngestResult(BaseModel):
+    accepted: int
+    unknown_children: List[str] = []
+    out_of_range: int = 0  # events timestamped in the future or too long ago
+
 # Helper functions
 def prepare_for_mongo(data):
-    if isinstance(data, dict):
-        if 'created_at' in data and isinstance(data['created_at'], datetime):
-            data['created_at'] = data['created_at'].isoformat()
+    # Timestamps are stored as native BSON dates so they can be range-queried
+    # and indexed; Motor encodes aware datetimes as UTC
     return data
 
+# Side effects of a completion still to apply, so a retry can finish them
+PENDING_EFFECTS = "pending_effects"
+EFFECTS_CLAIMED_AT = "effects_claimed_at"
+CHILD_STATS_EFFECT = "child_stats"
+ACTIVITY_EFFECT = "activity"
+
+def completion_document(completed: CompletedChallenge) -> dict:
+    # Marked as counted by apply_completions, unlike completions older than the rollups
+    return {
+        **prepare_for_mongo(completed.dict()),
+        ROLLED_UP: True,
+        PENDING_EFFECTS: [CHILD_STATS_EFFECT, ACTIVITY_EFFECT],
+        EFFECTS_CLAIMED_AT: completed.completed_at,
+    }
+
 def parse_from_mongo(item):
+    # Documents written before the datetime migration still hold ISO strings
     if isinstance(item, dict):
-        if 'created_at' in item and isinstance(item['created_at'], str):
-            item['created_at'] = datetime.fromisoformat(item['created_at'])
-        if 'completed_at' in item and isinstance(item['completed_at'], str):
-            item['completed_at'] = datetime.fromisoformat(item['completed_at'])
+        for field in ('created_at', 'completed_at'):
+            if field in item and not isinstance(item[field], datetime):
+                parsed = parse_datetime(item[field])
+                if parsed is not None:
+                    item[field] = parsed
     return item
 
+async def conditional_get(request: Request, keys: List[str], build, extra: List[str] = ()):
+    # Versions are read before the documents, so an ETag never runs ahead of
+    # the body it is sent with; a match skips the documents entirely. A body
+    # built from an in-memory copy must name that copy's version in `extra`.
+    etag = await versions.etag(request, keys, extra)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response = await build()
+    response.headers.update(headers)
+    return response
+
 # Routes
 
 @api_router.get("/")
@@ -148,19 +275,50 @@ async def create_child(child_data: ChildCreate):
     child = Child(**child_data.dict())
     child_dict = prepare_for_mongo(child.dict())
     await db.children.insert_one(child_dict)
+    await versions.bump("children", f"child:{child.id}")
     return child
 
+async def list_documents(request: Request, collection, model, query: dict,
+                         after: Optional[str], limit: Optional[int], batch_size: int):
+    # Rows written by this API are trusted: only the model's fields are
+    # fetched and they are serialized as-is, without a Pydantic round trip
+    fields = projection(model)
+    
+    # Accept: application/x-ndjson streams the whole result off the cursor
+    if wants_ndjson(request):
+        return stream_ndjson(collection, query, fields, after, limit, batch_size, dumps)
+    
+    docs, next_cursor = await fetch_page(collection, query, fields, after, limit or DEFAULT_PAGE_SIZE)
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return FastJSONResponse(docs, headers=headers)
+
 @api_router.get("/children", response_model=List[Child])
-async def get_children():
-    children = await db.children.find().to_list(1000)
-    return [Child(**parse_from_mongo(child)) for child in children]
+async def get_children(
+    request: Request,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    batch_size: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+):
+    return await conditional_get(request, ["children"], lambda: list_documents(
+        request, db.children, Child, {}, after, limit, batch_size
+    ))
 
 @api_router.get("/children/{child_id}", response_model=Child)
-async def get_child(child_id: str):
-    child = await db.children.find_one({"id": child_id})
-    if not child:
-        raise HTTPException(status_code=404, detail="Enfant non trouvé")
-    return Child(**parse_from_mongo(child))
+async def get_child(request: Request, child_id: str):
+    async def build():
+        child = await db.children.find_one({"id": child_id}, projection(Child))
+        if not child:
+            raise HTTPException(status_code=404, detail="Enfant non trouvé")
+        return FastJSONResponse(child)
+    return await conditional_get(request, [f"child:{child_id}"], build)
+
+# Every worker serves challenge listings from its own copy of the catalog
+catalog = ChallengeCatalog(
+    db,
+    projection(Challenge),
+    poll_interval=float(os.environ.get('CATALOG_POLL_SECONDS', 2)),
+    full_reload_interval=float(os.environ.get('CATALOG_FULL_RELOAD_SECONDS', 600)),
+)
 
 # Challenge routes
 @api_router.post("/challenges", response_model=Challenge)
@@ -168,163 +326,601 @@ async def create_challenge(challenge_data: ChallengeCreate):
     challenge = Challenge(**challenge_data.dict())
     challenge_dict = prepare_for_mongo(challenge.dict())
     await db.challenges.insert_one(challenge_dict)
+    challenge_cache.put(challenge_dict)
+    catalog.add(challenge_dict)
+    await asyncio.gather(catalog.bump_version(), versions.bump("challenges"))
     return challenge
 
+def build_import_document(row: dict) -> dict:
+    challenge = Challenge(**ChallengeCreate(**row).dict())
+    return prepare_for_mongo(challenge.dict())
+
+@api_router.post("/challenges/import")
+async def import_challenge_catalog(
+    request: Request,
+    file_format: Optional[str] = Query(None, alias="format", pattern="^(jsonl|csv)$"),
+    chunk_size: int = Query(1000, ge=1, le=10000),
+):
+    # The body is parsed as it arrives, JSONL unless it is declared as CSV
+    if file_format is None:
+        file_format = "csv" if "csv" in request.headers.get("content-type", "") else "jsonl"
+    try:
+        report = await import_challenges(db, parse_rows(file_format, request.stream()), build_import_document, chunk_size)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if report.inserted:
+        await asyncio.gather(catalog.bump_version(), versions.bump("challenges"))
+    return report.dict()
+
 @api_router.get("/challenges", response_model=List[Challenge])
-async def get_challenges(age: Optional[int] = None, category: Optional[str] = None):
+async def get_challenges(
+    request: Request,
+    age: Optional[int] = None,
+    category: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    batch_size: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+):
     query = {}
     if age:
         query["age_range.0"] = {"$lte": age}
         query["age_range.1"] = {"$gte": age}
     if category:
         query["category"] = category
-        
-    challenges = await db.challenges.find(query).to_list(1000)
-    return [Challenge(**parse_from_mongo(challenge)) for challenge in challenges]
+    
+    # JSON pages come from this worker's in-memory catalog once it is loaded
+    from_catalog = not wants_ndjson(request) and catalog.covers(age or None)
+    
+    async def build():
+        if from_catalog:
+            page_size = limit or DEFAULT_PAGE_SIZE
+            docs = catalog.query(category or None, age or None, after, page_size + 1)
+            headers = {NEXT_CURSOR_HEADER: docs[page_size - 1]["id"]} if len(docs) > page_size else None
+            return FastJSONResponse(docs[:page_size], headers=headers)
+        return await list_documents(request, db.challenges, Challenge, query, after, limit, batch_size)
+    # The catalog catches up with other workers' writes on its own poll, after
+    # the "challenges" version may already have moved: its version is part of the tag
+    extra = [f"catalog={catalog.generation}.{catalog.version}"] if from_catalog else []
+    return await conditional_get(request, ["challenges"], build, extra)
 
 @api_router.get("/challenges/{challenge_id}", response_model=Challenge)
-async def get_challenge(challenge_id: str):
-    challenge = await db.challenges.find_one({"id": challenge_id})
-    if not challenge:
-        raise HTTPException(status_code=404, detail="Défi non trouvé")
-    return Challenge(**parse_from_mongo(challenge))
+async def get_challenge(request: Request, challenge_id: str):
+    async def build():
+        challenge = await db.challenges.find_one({"id": challenge_id}, projection(Challenge))
+        if not challenge:
+            raise HTTPException(status_code=404, detail="Défi non trouvé")
+        return FastJSONResponse(challenge)
+    # Challenges never change once written
+    return await conditional_get(request, [f"challenge:{challenge_id}"], build)
 
 # AI-generated challenges
+def compute_fun_credits(duration_minutes: int, difficulty: str) -> int:
+    # Calculate fun credits based on difficulty and duration
+    base_credits = max(10, duration_minutes // 10)
+    difficulty_multiplier = {"easy": 1, "medium": 1.5, "hard": 2}
+    return int(base_credits * difficulty_multiplier.get(difficulty, 1))
+
+def build_generated_challenge(ai_data: dict, child_obj: Child) -> Challenge:
+    return Challenge(
+        title=ai_data["title"],
+        description=ai_data["description"],
+        category=ai_data["category"],
+        age_range=[max(1, child_obj.age - 2), child_obj.age + 3],
+        duration_minutes=ai_data["duration_minutes"],
+        difficulty=ai_data["difficulty"],
+        fun_credits=compute_fun_credits(ai_data.get("duration_minutes", 30), ai_data.get("difficulty", "easy")),
+        generated_for=child_obj.id
+    )
+
+def build_fallback_challenge(child_obj: Child) -> Challenge:
+    return Challenge(
+        title=f"Défi spécial pour {child_obj.name}",
+        description="Passe 30 minutes à faire une activité que tu aimes sans écran!",
+        category="creative",
+        age_range=[child_obj.age - 2, child_obj.age + 3],
+        duration_minutes=30,
+        difficulty="easy",
+        fun_credits=20,
+        generated_for=child_obj.id
+    )
+
+async def save_challenges(challenges: List[Challenge]) -> List[Challenge]:
+    challenge_dicts = [prepare_for_mongo(challenge.dict()) for challenge in challenges]
+    await db.challenges.insert_many(challenge_dicts)
+    for challenge_dict in challenge_dicts:
+        challenge_cache.put(challenge_dict)
+        catalog.add(challenge_dict)
+    await asyncio.gather(catalog.bump_version(), versions.bump("challenges"))
+    return challenges
+
+async def save_challenge(challenge: Challenge) -> Challenge:
+    await save_challenges([challenge])
+    return challenge
+
+async def generate_pool_template(slot: dict) -> dict:
+    # Same brief as the live prompt, with a placeholder instead of the name
+    name = NAME_PLACEHOLDER
+    prompt = f"""Hey ! C'est Nimo qui parle ! 🌟 
+    
+    Crée un défi OFF génial pour un enfant de {slot["age"]} ans, dont le prénom est {name}.
+    
+    IMPORTANT : Écris exactement "{name}" à la place du prénom dans le titre ET dans la description, il sera remplacé par le vrai prénom !
+    
+    Profil de l'enfant:
+    - Âge: {slot["age"]} ans
+    - Passions: {slot["interest"] or 'découvrir de nouvelles activités'}
+    - Catégorie défi: {slot["category"] or 'libre choix (surprise-moi !)'}
+    
+    Ton défi doit être:
+    ✨ Personnalisé avec le prénom {name}
+    🎯 Adapté à son âge et ses passions
+    🌟 Encourageant et positif (jamais "il faut", toujours "viens découvrir")
+    🎮 Ludique comme un jeu vidéo mais dans la vraie vie
+    
+    Réponds UNIQUEMENT avec ce format JSON:
+    {{
+        "title": "Titre accrocheur avec {name}",
+        "description": "Description motivante qui parle directement à {name}. Commence par 'Hey {name} !' ou '{name}, es-tu prêt(e) pour...' Style enthousiaste de Nimo !",
+        "category": "reading/outdoor/creative/family/sport/learning",
+        "duration_minutes": nombre_entier,
+        "difficulty": "easy/medium/hard"
+    }}
+    """
+    # Every unit of a slot's stock must be a different challenge
+    response = await llm_gateway.send("challenge_generator", prompt, coalesce=False)
+    ai_data = json.loads(response.strip())
+    template = {key: ai_data[key] for key in ("title", "description", "category", "duration_minutes", "difficulty")}
+    if not isinstance(template["duration_minutes"], int):
+        raise ValueError("duration_minutes is not an integer")
+    return template
+
+challenge_pool = ChallengePool(
+    db,
+    generate_pool_template,
+    target_depth=int(os.environ.get('CHALLENGE_POOL_TARGET_DEPTH', 5)),
+    low_water=int(os.environ.get('CHALLENGE_POOL_LOW_WATER', 2)),
+    concurrency=int(os.environ.get('CHALLENGE_POOL_CONCURRENCY', 2)),
+    slot_idle_seconds=float(os.environ.get('CHALLENGE_POOL_SLOT_IDLE_SECONDS', 3 * 86400)),
+    max_slots=int(os.environ.get('CHALLENGE_POOL_MAX_SLOTS', 200)),
+)
+
+async def generate_challenge_for(request: GenerateChallengeRequest) -> Challenge:
+    # Get child info
+    child = await db.children.find_one({"id": request.child_id})
+    if not child:
+        raise HTTPException(status_code=404, detail="Enfant non trouvé")
+    
+    child_obj = Child(**parse_from_mongo(child))
+    
+    # Serve a pre-generated challenge when the slot has stock
+    slot = challenge_pool.slot_for(child_obj.age, request.category, child_obj.interests)
+    template = await challenge_pool.take(slot)
+    if template:
+        return await save_challenge(build_generated_challenge(fill_template(template, child_obj.name), child_obj))
+    
+    # Generate challenge with AI
+    prompt = f"""Hey ! C'est Nimo qui parle ! 🌟 
+    
+    Crée un défi OFF génial personnalisé pour {child_obj.name}, {child_obj.age} ans.
+    
+    IMPORTANT : Utilise le prénom "{child_obj.name}" dans le titre ET dans la description pour rendre le défi unique et personnel !
+    
+    Profil de {child_obj.name}:
+    - Âge: {child_obj.age} ans
+    - Passions: {', '.join(child_obj.interests) if child_obj.interests else 'découvrir de nouvelles activités'}
+    - Catégorie défi: {request.category or 'libre choix (surprise-moi !)'}
+    
+    Ton défi doit être:
+    ✨ Personnalisé avec le prénom de {child_obj.name}
+    🎯 Adapté à son âge et ses passions
+    🌟 Encourageant et positif (jamais "il faut", toujours "viens découvrir")
+    🎮 Ludique comme un jeu vidéo mais dans la vraie vie
+    
+    Réponds UNIQUEMENT avec ce format JSON:
+    {{
+        "title": "Titre accrocheur avec le prénom de {child_obj.name}",
+        "description": "Description motivante qui parle directement à {child_obj.name}, utilise son prénom et ses passions. Commence par 'Hey {child_obj.name} !' ou '{child_obj.name}, es-tu prêt(e) pour...' Style enthousiaste de Nimo !",
+        "category": "reading/outdoor/creative/family/sport/learning",
+        "duration_minutes": nombre_entier,
+        "difficulty": "easy/medium/hard"
+    }}
+    """
+    
+    try:
+        # Two requests for the same child each save a challenge, they must not share one answer
+        response = await llm_gateway.send("challenge_generator", prompt, coalesce=False)
+    except LLMError as e:
+        # Provider degraded or circuit open: serve the fallback challenge
+        logging.warning(f"Challenge generation fell back: {str(e)}")
+        LLM_FALLBACKS.inc(provider="challenge_generator", reason="unavailable")
+        return await save_challenge(build_fallback_challenge(child_obj))
+    
+    # Parse AI response and create challenge
+    try:
+        ai_data = json.loads(response.strip())
+        return await save_challenge(build_generated_challenge(ai_data, child_obj))
+        
+    except json.JSONDecodeError:
+        # Fallback challenge if AI response is malformed
+        LLM_FALLBACKS.inc(provider="challenge_generator", reason="malformed")
+        return await save_challenge(build_fallback_challenge(child_obj))
+
 @api_router.post("/challenges/generate")
 async def generate_challenge(request: GenerateChallengeRequest):
     try:
-        # Get child info
-        child = await db.children.find_one({"id": request.child_id})
-        if not child:
-            raise HTTPException(status_code=404, detail="Enfant non trouvé")
-        
-        child_obj = Child(**parse_from_mongo(child))
-        
-        # Generate challenge with AI
-        gpt5_chat = get_gpt5_chat()
-        
-        prompt = f"""Hey ! C'est Nimo qui parle ! 🌟 
+        return await generate_challenge_for(request)
+    except Exception as e:
+        logging.error(f"Error generating challenge: {str(e)}")
+        raise HTTPException(status_code=500, detail="Erreur lors de la génération du défi")
+
+def build_plan_prompt(family_obj: Family, children: List[Child], per_child: int, category: Optional[str]) -> str:
+    # Children are numbered so the answer does not have to repeat their ids
+    profiles = "\n".join(
+        f"        {i}. {child.name}, {child.age} ans - passions: "
+        f"{', '.join(child.interests) if child.interests else 'découvrir de nouvelles activités'}"
+        for i, child in enumerate(children, start=1)
+    )
+    return f"""Hey ! C'est Nimo qui parle ! 🌟 
         
-        Crée un défi OFF génial personnalisé pour {child_obj.name}, {child_obj.age} ans.
+        Prépare le programme OFF de la semaine pour la famille {family_obj.name} : {per_child} défis personnalisés pour chaque enfant.
         
-        IMPORTANT : Utilise le prénom "{child_obj.name}" dans le titre ET dans la description pour rendre le défi unique et personnel !
+        Enfants:
+{profiles}
         
-        Profil de {child_obj.name}:
-        - Âge: {child_obj.age} ans
-        - Passions: {', '.join(child_obj.interests) if child_obj.interests else 'découvrir de nouvelles activités'}
-        - Catégorie défi: {request.category or 'libre choix (surprise-moi !)'}
+        Catégorie défis: {category or 'libre choix, varie les catégories'}
         
-        Ton défi doit être:
-        ✨ Personnalisé avec le prénom de {child_obj.name}
-        🎯 Adapté à son âge et ses passions
-        🌟 Encourageant et positif (jamais "il faut", toujours "viens découvrir")
-        🎮 Ludique comme un jeu vidéo mais dans la vraie vie
+        Chaque défi doit utiliser le prénom de l'enfant dans le titre ET dans la description, être adapté à son âge et ses passions, encourageant et ludique. Les défis d'un même enfant doivent être différents.
         
-        Réponds UNIQUEMENT avec ce format JSON:
+        Réponds UNIQUEMENT avec ce format JSON, une entrée par enfant avec exactement {per_child} défis:
         {{
-            "title": "Titre accrocheur avec le prénom de {child_obj.name}",
-            "description": "Description motivante qui parle directement à {child_obj.name}, utilise son prénom et ses passions. Commence par 'Hey {child_obj.name} !' ou '{child_obj.name}, es-tu prêt(e) pour...' Style enthousiaste de Nimo !",
-            "category": "reading/outdoor/creative/family/sport/learning",
-            "duration_minutes": nombre_entier,
-            "difficulty": "easy/medium/hard"
+            "plans": [
+                {{
+                    "child": numéro_de_l_enfant,
+                    "challenges": [
+                        {{
+                            "title": "Titre accrocheur avec le prénom",
+                            "description": "Description motivante qui parle directement à l'enfant",
+                            "category": "reading/outdoor/creative/family/sport/learning",
+                            "duration_minutes": nombre_entier,
+                            "difficulty": "easy/medium/hard"
+                        }}
+                    ]
+                }}
+            ]
         }}
         """
-        
-        user_message = UserMessage(text=prompt)
-        response = await gpt5_chat.send_message(user_message)
-        
-        # Parse AI response and create challenge
-        import json
+
+def parse_plan_items(response: str, child_count: int) -> dict:
+    """Challenge items per child number; anything malformed is simply missing."""
+    try:
+        plans = json.loads(response.strip()).get("plans")
+    except (json.JSONDecodeError, AttributeError):
+        return {}
+    items = {}
+    for plan in plans if isinstance(plans, list) else []:
+        if not isinstance(plan, dict) or not isinstance(plan.get("challenges"), list):
+            continue
         try:
-            ai_data = json.loads(response.strip())
-            
-            # Calculate fun credits based on difficulty and duration
-            base_credits = max(10, ai_data.get("duration_minutes", 30) // 10)
-            difficulty_multiplier = {"easy": 1, "medium": 1.5, "hard": 2}
-            fun_credits = int(base_credits * difficulty_multiplier.get(ai_data.get("difficulty", "easy"), 1))
-            
-            challenge = Challenge(
-                title=ai_data["title"],
-                description=ai_data["description"],
-                category=ai_data["category"],
-                age_range=[max(1, child_obj.age - 2), child_obj.age + 3],
-                duration_minutes=ai_data["duration_minutes"],
-                difficulty=ai_data["difficulty"],
-                fun_credits=fun_credits
-            )
-            
-            # Save to database
-            challenge_dict = prepare_for_mongo(challenge.dict())
-            await db.challenges.insert_one(challenge_dict)
-            
-            return challenge
-            
-        except json.JSONDecodeError:
-            # Fallback challenge if AI response is malformed
-            fallback_challenge = Challenge(
-                title=f"Défi spécial pour {child_obj.name}",
-                description="Passe 30 minutes à faire une activité que tu aimes sans écran!",
-                category="creative",
-                age_range=[child_obj.age - 2, child_obj.age + 3],
-                duration_minutes=30,
-                difficulty="easy",
-                fun_credits=20
-            )
-            
-            challenge_dict = prepare_for_mongo(fallback_challenge.dict())
-            await db.challenges.insert_one(challenge_dict)
-            return fallback_challenge
-            
-    except Exception as e:
-        logging.error(f"Error generating challenge: {str(e)}")
-        raise HTTPException(status_code=500, detail="Erreur lors de la génération du défi")
+            number = int(plan.get("child"))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= number <= child_count:
+            items.setdefault(number, []).extend(plan["challenges"])
+    return items
+
+@api_router.post("/families/{family_id}/plan", response_model=FamilyPlan)
+async def generate_family_plan(family_id: str, request: FamilyPlanRequest):
+    family = await db.families.find_one({"id": family_id}, projection(Family))
+    if not family:
+        raise HTTPException(status_code=404, detail="Famille non trouvée")
+    family_obj = Family(**parse_from_mongo(family))
+    
+    children_by_id = {
+        child["id"]: Child(**parse_from_mongo(child))
+        for child in await db.children.find({"id": {"$in": family_obj.children}}, projection(Child)).to_list(None)
+    }
+    children = [children_by_id[child_id] for child_id in family_obj.children if child_id in children_by_id]
+    if not children:
+        raise HTTPException(status_code=400, detail="La famille n'a pas encore d'enfant")
+    
+    per_child = request.challenges_per_child
+    # One provider round trip for the whole family instead of one per challenge
+    try:
+        response = await llm_gateway.send(
+            "challenge_generator", build_plan_prompt(family_obj, children, per_child, request.category),
+            coalesce=False,
+        )
+        items = parse_plan_items(response, len(children))
+    except LLMError as e:
+        logging.warning(f"Family plan generation fell back: {str(e)}")
+        items = {}
+    
+    plans, to_save, fallbacks = [], [], 0
+    for number, child in enumerate(children, start=1):
+        child_items = items.get(number, [])
+        challenges = []
+        for i in range(per_child):
+            try:
+                challenges.append(build_generated_challenge(child_items[i], child))
+            except (IndexError, KeyError, TypeError, ValueError):
+                # Missing or malformed item: that one challenge falls back
+                challenges.append(build_fallback_challenge(child))
+                fallbacks += 1
+        to_save.extend(challenges)
+        plans.append(ChildPlan(child_id=child.id, child_name=child.name, challenges=challenges))
+    
+    if fallbacks:
+        LLM_FALLBACKS.inc(fallbacks, provider="challenge_generator", reason="plan_item")
+    await save_challenges(to_save)
+    return FamilyPlan(family_id=family_id, plans=plans, generated=len(to_save) - fallbacks, fallbacks=fallbacks)
+
+# Local recommendations: scored against the in-memory catalog, no LLM call
+recommender = ChallengeRecommender()
+
+@api_router.get("/children/{child_id}/recommendations", response_model=List[Challenge])
+async def get_recommendations(
+    child_id: str,
+    limit: int = Query(10, ge=1, le=50),
+    category: Optional[str] = None,
+):
+    child, stats, completed_ids = await asyncio.gather(
+        db.children.find_one({"id": child_id}, projection(Child)),
+        db.child_stats.find_one({"_id": child_id}, {"categories": 1, "recent_challenges": 1}),
+        db.completed_challenges.distinct("challenge_id", {"child_id": child_id}),
+    )
+    if not child:
+        raise HTTPException(status_code=404, detail="Enfant non trouvé")
+    
+    if not catalog.ready:
+        await catalog.refresh()
+    recommender.sync(catalog)
+    
+    stats = stats or {}
+    ids = recommender.recommend(
+        age=child["age"],
+        interests=child.get("interests") or [],
+        category_counts=stats.get("categories", {}),
+        recent_ids=[c["challenge_id"] for c in stats.get("recent_challenges", [])],
+        exclude_ids=completed_ids,
+        limit=limit,
+        category=category,
+    )
+    return FastJSONResponse([catalog.get(challenge_id) for challenge_id in ids])
 
 # Complete challenge
+MAX_BATCH_COMPLETIONS = 5000
+
+# A replay or the sweeper takes over the side effects of a request that has held them this long
+EFFECTS_LEASE_SECONDS = float(os.environ.get('COMPLETION_EFFECTS_LEASE_SECONDS', 30))
+EFFECTS_SWEEP_SECONDS = float(os.environ.get('COMPLETION_EFFECTS_SWEEP_SECONDS', 60))
+EFFECTS_SWEEP_BATCH = 500
+
+def claimable_effects() -> dict:
+    # Completions with side effects left that no live request is applying
+    return {
+        PENDING_EFFECTS: {"$exists": True},
+        "$or": [
+            {EFFECTS_CLAIMED_AT: None},
+            {EFFECTS_CLAIMED_AT: {"$lt": datetime.now(timezone.utc) - timedelta(seconds=EFFECTS_LEASE_SECONDS)}},
+        ],
+    }
+
+async def on_challenges_completed(completed_dicts: List[dict]):
+    """Side effects shared by every path that records completions.
+
+    The counters are incremented, not recomputed, so each effect is applied
+    once: it is pulled from the completions' PENDING_EFFECTS as soon as it
+    succeeded, and an effect that failed is left for a retry to apply.
+    """
+    metadata = await challenge_cache.get_many(db, [c["challenge_id"] for c in completed_dicts])
+    effects = {
+        CHILD_STATS_EFFECT: lambda docs: apply_completions(db, docs, metadata),
+        ACTIVITY_EFFECT: lambda docs: record_activity(db, docs),
+    }
+    names, calls = [], []
+    for name, apply in effects.items():
+        docs = [c for c in completed_dicts if name in c.get(PENDING_EFFECTS, [])]
+        if docs:
+            names.append(name)
+            calls.append(apply(docs))
+    outcomes = await asyncio.gather(
+        *calls, coaching_cache.invalidate_children({c["child_id"] for c in completed_dicts}),
+        return_exceptions=True,
+    )
+    applied = [name for name, outcome in zip(names, outcomes) if not isinstance(outcome, BaseException)]
+    # Releases the claim as well, so a retry can apply what failed at once. Finished
+    # completions lose the field, which keeps the index the sweeper reads small.
+    finished, unfinished = [], []
+    for c in completed_dicts:
+        (finished if set(c.get(PENDING_EFFECTS, [])) <= set(applied) else unfinished).append(c["id"])
+    if finished:
+        await db.completed_challenges.update_many(
+            {"id": {"$in": finished}}, {"$unset": {PENDING_EFFECTS: "", EFFECTS_CLAIMED_AT: ""}}
+        )
+    if unfinished:
+        await db.completed_challenges.update_many(
+            {"id": {"$in": unfinished}},
+            {"$pull": {PENDING_EFFECTS: {"$in": applied}}, "$unset": {EFFECTS_CLAIMED_AT: ""}},
+        )
+    await versions.bump(*(f"child_stats:{c['child_id']}" for c in completed_dicts))
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+    # Live clients are updated in the background, the completion does not wait for them
+    task = asyncio.create_task(publish_completion_events(completed_dicts))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+IDEMPOTENT_REPLAY_HEADER = "Idempotent-Replayed"
+
+async def replay_completion(idempotency_key: str, request: CompleteChallengeRequest):
+    completed = await db.completed_challenges.find_one(
+        {"idempotency_key": idempotency_key}, {**projection(CompletedChallenge), "idempotency_key": 1}
+    )
+    if completed is None:
+        raise HTTPException(status_code=409, detail="Requête déjà en cours, réessayez")
+    completed.pop("idempotency_key")
+    if (completed["child_id"], completed["challenge_id"], completed["validation_method"]) != (
+        request.child_id, request.challenge_id, request.validation_method
+    ):
+        raise HTTPException(status_code=409, detail="Clé d'idempotence déjà utilisée pour une autre requête")
+    
+    # The first attempt failed before its side effects were all applied: finish them
+    pending = await db.completed_challenges.find_one_and_update(
+        {"id": completed["id"], **claimable_effects()},
+        {"$set": {EFFECTS_CLAIMED_AT: datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if pending is not None:
+        await on_challenges_completed([pending])
+    elif await db.completed_challenges.find_one({"id": completed["id"], PENDING_EFFECTS: {"$exists": True}},
+                                                {"_id": 1}):
+        raise HTTPException(status_code=409, detail="Requête déjà en cours, réessayez")
+    return FastJSONResponse(completed, headers={IDEMPOTENT_REPLAY_HEADER: "true"})
+
+async def sweep_pending_effects() -> int:
+    """Apply the side effects left by completions whose request failed or died.
+
+    Completions recorded without an Idempotency-Key, and batches, are never
+    replayed; without this their rollups would undercount for good.
+    """
+    swept = 0
+    while True:
+        claimed = []
+        while len(claimed) < EFFECTS_SWEEP_BATCH:
+            doc = await db.completed_challenges.find_one_and_update(
+                claimable_effects(),
+                {"$set": {EFFECTS_CLAIMED_AT: datetime.now(timezone.utc)}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if doc is None:
+                break
+            claimed.append(doc)
+        if not claimed:
+            return swept
+        await on_challenges_completed(claimed)
+        swept += len(claimed)
+
+async def run_effects_sweeper():
+    while True:
+        try:
+            swept = await sweep_pending_effects()
+            if swept:
+                logger.info(f"Applied the pending side effects of {swept} completions")
+        except Exception as e:
+            logger.error(f"Completion side effects sweep failed: {e}")
+        await asyncio.sleep(EFFECTS_SWEEP_SECONDS)
+
 @api_router.post("/challenges/complete", response_model=CompletedChallenge)
-async def complete_challenge(request: CompleteChallengeRequest):
-    # Verify child and challenge exist
-    child = await db.children.find_one({"id": request.child_id})
+async def complete_challenge(
+    request: CompleteChallengeRequest,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255),
+):
+    # Verify child and challenge exist, concurrently; the challenge usually comes from the cache
+    child, challenge = await asyncio.gather(
+        db.children.find_one({"id": request.child_id}, {"_id": 1}),
+        challenge_cache.get(db, request.challenge_id),
+    )
     if not child:
         raise HTTPException(status_code=404, detail="Enfant non trouvé")
-        
-    challenge = await db.challenges.find_one({"id": request.challenge_id})
     if not challenge:
         raise HTTPException(status_code=404, detail="Défi non trouvé")
     
-    challenge_obj = Challenge(**parse_from_mongo(challenge))
-    
     # Create completed challenge
     completed = CompletedChallenge(
         child_id=request.child_id,
         challenge_id=request.challenge_id,
-        fun_credits_earned=challenge_obj.fun_credits,
+        fun_credits_earned=challenge["fun_credits"],
         validation_method=request.validation_method
     )
     
-    completed_dict = prepare_for_mongo(completed.dict())
-    await db.completed_challenges.insert_one(completed_dict)
+    completed_dict = completion_document(completed)
+    if idempotency_key:
+        completed_dict["idempotency_key"] = idempotency_key
+    try:
+        await db.completed_challenges.insert_one(completed_dict)
+    except DuplicateKeyError:
+        # A retry: the unique index kept it from counting twice
+        if not idempotency_key:
+            raise
+        return await replay_completion(idempotency_key, request)
+    await on_challenges_completed([completed_dict])
     
     return completed
 
+@api_router.post("/challenges/complete/batch", response_model=List[BatchCompletionResult])
+async def complete_challenges_batch(requests: List[CompleteChallengeRequest]):
+    if len(requests) > MAX_BATCH_COMPLETIONS:
+        raise HTTPException(status_code=413, detail=f"Trop de défis dans le lot (maximum {MAX_BATCH_COMPLETIONS})")
+    
+    # Verify every child and challenge with one $in query each
+    child_ids = {r.child_id for r in requests}
+    children = await db.children.find({"id": {"$in": list(child_ids)}}, {"_id": 0, "id": 1}).to_list(None)
+    known_children = {c["id"] for c in children}
+    challenges = await challenge_cache.get_many(db, [r.challenge_id for r in requests])
+    
+    results = [BatchCompletionResult(index=i, status="error") for i in range(len(requests))]
+    pending = []  # (result index, completed)
+    for i, request in enumerate(requests):
+        if request.child_id not in known_children:
+            results[i].error = "Enfant non trouvé"
+        elif request.challenge_id not in challenges:
+            results[i].error = "Défi non trouvé"
+        else:
+            pending.append((i, CompletedChallenge(
+                child_id=request.child_id,
+                challenge_id=request.challenge_id,
+                fun_credits_earned=challenges[request.challenge_id]["fun_credits"],
+                validation_method=request.validation_method
+            )))
+    
+    if pending:
+        completed_dicts = [completion_document(completed) for _, completed in pending]
+        failed = set()
+        try:
+            await db.completed_challenges.insert_many(completed_dicts, ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+        
+        for position, (i, completed) in enumerate(pending):
+            if position in failed:
+                results[i].error = "Erreur lors de l'enregistrement"
+            else:
+                results[i].status = "created"
+                results[i].completed = completed
+        
+        await on_challenges_completed([c for position, c in enumerate(completed_dicts) if position not in failed])
+    
+    return results
+
 # Family routes
 @api_router.post("/families", response_model=Family)
 async def create_family(family_data: FamilyCreate):
     family = Family(**family_data.dict())
     family_dict = prepare_for_mongo(family.dict())
     await db.families.insert_one(family_dict)
+    await versions.bump("families", f"family:{family.id}")
     return family
 
 @api_router.get("/families", response_model=List[Family])
-async def get_families():
-    families = await db.families.find().to_list(1000)
-    return [Family(**parse_from_mongo(family)) for family in families]
+async def get_families(
+    request: Request,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    batch_size: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+):
+    return await conditional_get(request, ["families"], lambda: list_documents(
+        request, db.families, Family, {}, after, limit, batch_size
+    ))
 
 @api_router.get("/families/{family_id}", response_model=Family)
-async def get_family(family_id: str):
-    family = await db.families.find_one({"id": family_id})
-    if not family:
-        raise HTTPException(status_code=404, detail="Famille non trouvée")
-    return Family(**parse_from_mongo(family))
+async def get_family(request: Request, family_id: str):
+    async def build():
+        family = await db.families.find_one({"id": family_id}, projection(Family))
+        if not family:
+            raise HTTPException(status_code=404, detail="Famille non trouvée")
+        return FastJSONResponse(family)
+    return await conditional_get(request, [f"family:{family_id}"], build)
 
 @api_router.post("/families/{family_id}/add-child/{child_id}")
 async def add_child_to_family(family_id: str, child_id: str):
@@ -342,29 +938,115 @@ async def add_child_to_family(family_id: str, child_id: str):
             {"id": family_id},
             {"$push": {"children": child_id}}
         )
+        await asyncio.gather(
+            coaching_cache.invalidate_family(family_id),
+            versions.bump("families", f"family:{family_id}"),
+        )
     
     return {"message": "Enfant ajouté à la famille"}
 
+# Screen time reported by devices, buffered and written in batches
+MAX_SCREEN_TIME_EVENTS = 10000
+
+async def on_screen_time_flushed(family_ids: List[str]):
+    await versions.bump("families", *(f"family:{family_id}" for family_id in family_ids))
+
+screen_time = ScreenTimeIngestor(
+    db,
+    flush_interval=float(os.environ.get('SCREEN_TIME_FLUSH_SECONDS', 1)),
+    max_events=int(os.environ.get('SCREEN_TIME_MAX_PENDING', 50000)),
+    max_clock_skew=float(os.environ.get('SCREEN_TIME_MAX_CLOCK_SKEW_SECONDS', 300)),
+    max_age_days=int(os.environ.get('SCREEN_TIME_MAX_AGE_DAYS', 31)),
+    on_families_updated=on_screen_time_flushed,
+)
+
+@api_router.post("/screen-time/events", response_model=ScreenTimeIngestResult, status_code=202)
+async def ingest_screen_time(events: List[ScreenTimeEvent]):
+    if len(events) > MAX_SCREEN_TIME_EVENTS:
+        raise HTTPException(status_code=413, detail=f"Trop d'événements dans le lot (maximum {MAX_SCREEN_TIME_EVENTS})")
+    # Events of unknown children or with an implausible timestamp are skipped, the others are accepted
+    unknown = set(await screen_time.unknown_children(e.child_id for e in events))
+    known = [e for e in events if e.child_id not in unknown]
+    now = datetime.now(timezone.utc)
+    in_range = [e for e in known if screen_time.accepts(e.at, now)]
+    accepted = screen_time.add(e.dict() for e in in_range)
+    return FastJSONResponse({
+        "accepted": accepted,
+        "unknown_children": sorted(unknown),
+        "out_of_range": len(known) - len(in_range),
+    }, status_code=202)
+
+@api_router.get("/stats/screen-time")
+async def get_screen_time_stats():
+    return screen_time.stats()
+
 # Stats and leaderboard
-@api_router.get("/stats/child/{child_id}")
-async def get_child_stats(child_id: str):
-    # Get completed challenges for this child
-    completed = await db.completed_challenges.find({"child_id": child_id}).to_list(1000)
+def format_child_stats(child_id: str, stats: dict) -> dict:
+    return {
+        "child_id": child_id,
+        "total_fun_credits": stats.get("total_fun_credits", 0),
+        "total_challenges_completed": stats.get("total_challenges_completed", 0),
+        "categories_breakdown": stats.get("categories", {}),
+        "recent_challenges": stats.get("recent_challenges", [])
+    }
+
+async def child_totals(child_ids: List[str]) -> dict:
+    # Totals from the rollups, aggregated from raw completions for children whose
+    # rollup is missing or not yet seeded with their older history
+    totals = {}
+    async for stats in db.child_stats.find(
+        {"_id": {"$in": child_ids}, "seeded": True}, {"total_challenges_completed": 1, "total_fun_credits": 1}
+    ):
+        totals[stats["_id"]] = stats
+    missing = [child_id for child_id in child_ids if child_id not in totals]
+    if missing:
+        async for stats in db.completed_challenges.aggregate([
+            {"$match": {"child_id": {"$in": missing}}},
+            {"$group": {
+                "_id": "$child_id",
+                "total_challenges_completed": {"$sum": 1},
+                "total_fun_credits": {"$sum": {"$ifNull": ["$fun_credits_earned", 0]}},
+            }},
+        ]):
+            totals[stats["_id"]] = stats
+    return totals
+
+async def load_child_stats(child_id: str) -> FastJSONResponse:
+    # Rollup maintained by the completion routes: one primary-key read
+    stats = await db.child_stats.find_one({"_id": child_id})
+    if stats and stats.get("seeded"):
+        return FastJSONResponse(format_child_stats(child_id, stats))
     
-    total_credits = sum(c.get("fun_credits_earned", 0) for c in completed)
-    total_challenges = len(completed)
+    # No complete rollup yet (history predates it and is not backfilled): totals per challenge, computed by the database in one pass
+    per_challenge = await db.completed_challenges.aggregate([
+        {"$match": {"child_id": child_id}},
+        {"$group": {
+            "_id": "$challenge_id",
+            "count": {"$sum": 1},
+            "credits": {"$sum": {"$ifNull": ["$fun_credits_earned", 0]}},
+        }},
+    ]).to_list(None)
     
-    # Categories breakdown
+    total_credits = sum(c["credits"] for c in per_challenge)
+    total_challenges = sum(c["count"] for c in per_challenge)
+    
+    # Categories breakdown, resolved through the metadata cache (one $in for misses)
+    metadata = await challenge_cache.get_many(db, [c["_id"] for c in per_challenge])
     categories = {}
-    for c in completed:
-        challenge = await db.challenges.find_one({"id": c["challenge_id"]})
+    for c in per_challenge:
+        challenge = metadata.get(c["_id"])
         if challenge:
-            category = challenge.get("category", "other")
-            categories[category] = categories.get(category, 0) + 1
+            category = challenge.get("category") or "other"
+            categories[category] = categories.get(category, 0) + c["count"]
     
     # Clean recent challenges data to avoid ObjectId issues
+    recent = await db.completed_challenges.find(
+        {"child_id": child_id},
+        {"_id": 0, "id": 1, "child_id": 1, "challenge_id": 1, "completed_at": 1,
+         "fun_credits_earned": 1, "validation_method": 1},
+    ).sort("completed_at", -1).limit(5).to_list(5)
     recent_challenges = []
-    for c in completed[-5:] if completed else []:
+    for c in reversed(recent):
         clean_challenge = {
             "id": c.get("id"),
             "child_id": c.get("child_id"),
@@ -375,98 +1057,232 @@ async def get_child_stats(child_id: str):
         }
         recent_challenges.append(clean_challenge)
     
-    return {
+    return FastJSONResponse({
         "child_id": child_id,
         "total_fun_credits": total_credits,
         "total_challenges_completed": total_challenges,
         "categories_breakdown": categories,
         "recent_challenges": recent_challenges
-    }
+    })
+
+@api_router.get("/stats/child/{child_id}")
+async def get_child_stats(request: Request, child_id: str):
+    return await conditional_get(request, [f"child_stats:{child_id}"], lambda: load_child_stats(child_id))
+
+@api_router.get("/stats/versions")
+async def get_version_stats():
+    return versions.stats()
+
+@api_router.get("/stats/cache")
+async def get_cache_stats():
+    return {"challenge_metadata": challenge_cache.stats()}
+
+@api_router.get("/stats/catalog")
+async def get_catalog_stats():
+    return catalog.stats()
+
+@api_router.get("/stats/llm")
+async def get_llm_stats():
+    return llm_gateway.stats()
+
+@api_router.get("/metrics")
+async def get_metrics():
+    return Response(render_metrics(), media_type=PROMETHEUS_MEDIA_TYPE)
+
+@api_router.get("/stats/pool")
+async def get_pool_stats():
+    return await challenge_pool.stats()
+
+# Rankings are served from snapshots rebuilt in the background
+SNAPSHOT_AGE_HEADER = "X-Snapshot-Age"
+SNAPSHOT_VERSION_HEADER = "X-Snapshot-Version"
+
+leaderboard_snapshots = LeaderboardSnapshots(
+    db,
+    interval=float(os.environ.get('LEADERBOARD_SNAPSHOT_SECONDS', 60)),
+)
+
+def snapshot_headers(snapshot) -> dict:
+    return {SNAPSHOT_AGE_HEADER: str(int(snapshot.age())), SNAPSHOT_VERSION_HEADER: str(snapshot.version)}
+
+@api_router.get("/stats/leaderboard")
+async def get_leaderboard_stats():
+    return leaderboard_snapshots.stats()
 
 @api_router.get("/leaderboard", response_model=List[Leaderboard])
-async def get_leaderboard():
-    families = await db.families.find().to_list(1000)
-    leaderboard_data = []
+async def get_leaderboard(
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    window: Optional[str] = Query(None, pattern="^(day|week|month|all)$"),
+):
+    # Without a window: lifetime credits and completions of the last 7 days.
+    # With one: credits and completions within that calendar window.
+    snapshot = await leaderboard_snapshots.ensure(window)
+    if snapshot is None:
+        leaderboard_data = await compute_leaderboard(db, offset=offset, limit=limit, window=window)
+        return FastJSONResponse(leaderboard_data)
+    return FastJSONResponse(snapshot.page(offset, limit), headers=snapshot_headers(snapshot))
+
+@api_router.get("/leaderboard/family/{family_id}", response_model=FamilyRank)
+async def get_family_rank(
+    family_id: str,
+    neighbours: int = Query(2, ge=0, le=50),
+    window: Optional[str] = Query(None, pattern="^(day|week|month|all)$"),
+):
+    snapshot = await leaderboard_snapshots.ensure(window)
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Classement indisponible")
+    position = snapshot.around(family_id, neighbours)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Famille non trouvée")
+    return FastJSONResponse(position, headers=snapshot_headers(snapshot))
+
+# Live updates: completion deltas pushed over Server-Sent Events or WebSocket
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get('LIVE_HEARTBEAT_SECONDS', 15))
+
+async def publish_completion_events(completed_dicts: List[dict]):
+    # One event per child: what was earned and the child's and family's new totals
+    try:
+        earned = {}
+        for completed in completed_dicts:
+            count, credits = earned.get(completed["child_id"], (0, 0))
+            earned[completed["child_id"]] = (count + 1, credits + completed.get("fun_credits_earned", 0))
+        families = await db.families.find(
+            {"children": {"$in": list(earned)}}, {"_id": 0, "id": 1, "children": 1}
+        ).to_list(None)
+        family_children = {child_id for family in families for child_id in family.get("children", [])}
+        totals = await child_totals(list(family_children | set(earned)))
+        family_of, family_credits = {}, {}
+        for family in families:
+            family_credits[family["id"]] = sum(
+                totals.get(child_id, {}).get("total_fun_credits", 0) for child_id in family.get("children", [])
+            )
+            for child_id in family.get("children", []):
+                family_of.setdefault(child_id, family["id"])
+        now = datetime.now(timezone.utc)
+        await event_bus.publish(*({
+            "type": "completion",
+            "child_id": child_id,
+            "family_id": family_of.get(child_id),
+            "challenges_completed": count,
+            "credits_earned": credits,
+            "child_total_credits": totals.get(child_id, {}).get("total_fun_credits", 0),
+            "child_total_challenges": totals.get(child_id, {}).get("total_challenges_completed", 0),
+            "family_total_credits": family_credits.get(family_of.get(child_id)),
+            "at": now,
+        } for child_id, (count, credits) in earned.items()))
+    except Exception as e:
+        logging.error(f"Error publishing completion events: {str(e)}")
+
+def in_top(event: dict, top: int) -> bool:
+    # Judged against this worker's snapshot: families already in the top N,
+    # and families whose new total reaches the N-th score
+    snapshot = leaderboard_snapshots.get(None)
+    if snapshot is None or len(snapshot) < top:
+        return True
+    position = snapshot.position(event["family_id"]) if event.get("family_id") else None
+    if position is not None and position < top:
+        return True
+    return (event.get("family_total_credits") or 0) >= snapshot.rows[top - 1]["total_credits"]
+
+def live_filter(family_id: Optional[str], top: Optional[int]):
+    if family_id is None and top is None:
+        return None
+    def predicate(event: dict) -> bool:
+        if event["type"] != "completion":
+            return True
+        if family_id is not None and event.get("family_id") == family_id:
+            return True
+        return top is not None and in_top(event, top)
+    return predicate
+
+async def live_events(request: Request, family_id: Optional[str], top: Optional[int]):
+    with event_bus.subscribe(live_filter(family_id, top)) as subscription:
+        while not await request.is_disconnected():
+            event = await subscription.get(LIVE_HEARTBEAT_SECONDS)
+            # A comment line keeps idle connections open through proxies
+            yield format_event(event["type"], event) if event else ": keepalive\n\n"
+
+@api_router.get("/live")
+async def stream_live(
+    request: Request,
+    family_id: Optional[str] = None,
+    top: Optional[int] = Query(None, ge=1, le=1000),
+):
+    # Without a filter every completion is sent; "resync" means events were dropped, refetch
+    return event_stream_response(live_events(request, family_id, top))
+
+@api_router.websocket("/ws/live")
+async def websocket_live(
+    websocket: WebSocket,
+    family_id: Optional[str] = None,
+    top: Optional[int] = Query(None, ge=1, le=1000),
+):
+    await websocket.accept()
+    with event_bus.subscribe(live_filter(family_id, top)) as subscription:
+        async def forward():
+            while True:
+                event = await subscription.get(LIVE_HEARTBEAT_SECONDS)
+                await websocket.send_text(dumps(event or {"type": "ping"}).decode("utf-8"))
+        sender = asyncio.create_task(forward())
+        try:
+            # Clients only listen: anything they send is ignored until they close
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            sender.cancel()
+            await asyncio.gather(sender, return_exceptions=True)
+
+@api_router.get("/stats/live")
+async def get_live_stats():
+    return event_bus.stats()
+
+# Family coaching with AI
+async def load_coaching_input(family_id: str):
+    """Family, its children's coaching data, and the cache invalidation count they were read under."""
+    family = await db.families.find_one({"id": family_id})
+    if not family:
+        raise HTTPException(status_code=404, detail="Famille non trouvée")
     
-    for family in families:
+    family_obj = Family(**parse_from_mongo(family))
+    invalidations = await coaching_cache.begin(family_id, family_obj.children)
+    # A child added before begin() did not count as an invalidation: re-read the family
+    family = await db.families.find_one({"id": family_id})
+    if not family:
+        raise HTTPException(status_code=404, detail="Famille non trouvée")
+    if family.get("children", []) != family_obj.children:
         family_obj = Family(**parse_from_mongo(family))
-        
-        # Calculate total credits for family
-        total_credits = 0
-        weekly_challenges = 0
-        
-        for child_id in family_obj.children:
-            completed = await db.completed_challenges.find({"child_id": child_id}).to_list(1000)
-            total_credits += sum(c.get("fun_credits_earned", 0) for c in completed)
-            
-            # Count challenges from last 7 days
-            from datetime import timedelta
-            week_ago = datetime.now(timezone.utc) - timedelta(days=7)
-            recent_completed = []
-            for c in completed:
-                try:
-                    completed_at = c["completed_at"]
-                    if isinstance(completed_at, str):
-                        completed_at = datetime.fromisoformat(completed_at)
-                    elif isinstance(completed_at, datetime):
-                        pass  # Already a datetime object
-                    else:
-                        continue  # Skip invalid dates
-                    
-                    # Ensure timezone compatibility
-                    if completed_at.tzinfo is None:
-                        completed_at = completed_at.replace(tzinfo=timezone.utc)
-                    
-                    if completed_at > week_ago:
-                        recent_completed.append(c)
-                except (ValueError, KeyError, TypeError):
-                    continue  # Skip invalid entries
-            weekly_challenges += len(recent_completed)
-        
-        leaderboard_data.append({
-            "family_id": family_obj.id,
-            "family_name": family_obj.name,
-            "total_credits": total_credits,
-            "weekly_challenges": weekly_challenges
-        })
-    
-    # Sort by total credits descending
-    leaderboard_data.sort(key=lambda x: x["total_credits"], reverse=True)
+        invalidations = await coaching_cache.begin(family_id, family_obj.children)
     
-    # Add ranks
-    for i, entry in enumerate(leaderboard_data):
-        entry["rank"] = i + 1
+    # Get family stats
+    children = await db.children.find(
+        {"id": {"$in": family_obj.children}}, {"_id": 0, "id": 1, "name": 1, "age": 1}
+    ).to_list(None)
+    children_by_id = {child["id"]: child for child in children}
+    totals = await child_totals(family_obj.children)
     
-    return [Leaderboard(**entry) for entry in leaderboard_data]
+    children_data = []
+    for child_id in family_obj.children:
+        child = children_by_id.get(child_id)
+        if child:
+            child_stats = totals.get(child_id, {})
+            children_data.append({
+                "name": child["name"],
+                "age": child["age"],
+                "challenges_completed": child_stats.get("total_challenges_completed", 0),
+                "total_credits": child_stats.get("total_fun_credits", 0)
+            })
+    return family_obj, children_data, invalidations
 
-# Family coaching with AI
-@api_router.get("/coaching/{family_id}")
-async def get_family_coaching(family_id: str):
-    try:
-        family = await db.families.find_one({"id": family_id})
-        if not family:
-            raise HTTPException(status_code=404, detail="Famille non trouvée")
-        
-        family_obj = Family(**parse_from_mongo(family))
-        
-        # Get family stats
-        children_data = []
-        for child_id in family_obj.children:
-            child = await db.children.find_one({"id": child_id})
-            completed = await db.completed_challenges.find({"child_id": child_id}).to_list(1000)
-            
-            if child:
-                children_data.append({
-                    "name": child["name"],
-                    "age": child["age"],
-                    "challenges_completed": len(completed),
-                    "total_credits": sum(c.get("fun_credits_earned", 0) for c in completed)
-                })
-        
-        # Generate coaching advice with Claude
-        claude_chat = get_claude4_chat()
-        
-        prompt = f"""Analyse cette famille et donne des conseils personnalisés:
+def summarize_coaching_input(children_data: List[dict]) -> dict:
+    return {
+        "total_children": len(children_data),
+        "total_challenges": sum(c["challenges_completed"] for c in children_data),
+        "total_credits": sum(c["total_credits"] for c in children_data)
+    }
+
+def build_coaching_prompt(family_obj: Family, children_data: List[dict]) -> str:
+    return f"""Analyse cette famille et donne des conseils personnalisés:
         
         Famille: {family_obj.name}
         Enfants: {children_data}
@@ -477,33 +1293,200 @@ async def get_family_coaching(family_id: str):
         3. Motiver les enfants dans leurs défis
         
         Réponds en français, de façon chaleureuse et encourageante."""
+
+def coaching_advice_events(family_id: str, advice: str):
+    for paragraph in advice.split("\n\n"):
+        if paragraph.strip():
+            yield format_event("coaching_advice", {"text": paragraph})
+    yield format_event("done", {"family_id": family_id})
+
+async def stream_cached_coaching(family_id: str, cached: dict):
+    yield format_event("family_stats", {"family_id": family_id, **cached["family_stats"]})
+    for event in coaching_advice_events(family_id, cached["coaching_advice"]):
+        yield event
+
+async def stream_family_coaching(request: Request, family_id: str, family_obj: Family,
+                                 children_data: List[dict], digest: str, invalidations: int):
+    # Stats are known before the LLM answers, send them first
+    family_stats = summarize_coaching_input(children_data)
+    yield format_event("family_stats", {"family_id": family_id, **family_stats})
+    
+    advice = asyncio.ensure_future(llm_gateway.send("family_coach", build_coaching_prompt(family_obj, children_data)))
+    try:
+        while not advice.done():
+            if await request.is_disconnected():
+                return
+            await asyncio.wait({advice}, timeout=0.5)
         
-        user_message = UserMessage(text=prompt)
-        response = await claude_chat.send_message(user_message)
+        try:
+            response = advice.result()
+        except LLMError as e:
+            logging.error(f"Error generating coaching: {str(e)}")
+            yield format_event("error", {"detail": "Erreur lors de la génération des conseils"})
+            return
         
-        return {
-            "family_id": family_id,
-            "coaching_advice": response,
-            "family_stats": {
-                "total_children": len(children_data),
-                "total_challenges": sum(c["challenges_completed"] for c in children_data),
-                "total_credits": sum(c["total_credits"] for c in children_data)
-            }
-        }
+        await coaching_cache.put(family_id, digest, family_obj.children, response, family_stats, invalidations)
+        for event in coaching_advice_events(family_id, response):
+            yield event
+    finally:
+        # Client gone: stop waiting so the gateway can cancel the provider call
+        advice.cancel()
+
+def coaching_response(request: Request, cached: dict):
+    etag = f'"{cached["etag"]}"'
+    # The advice changes with the family's stats, so clients revalidate every
+    # time; the cache max age only bounds how long the server keeps it
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse({
+        "family_id": cached["family_id"],
+        "coaching_advice": cached["coaching_advice"],
+        "family_stats": cached["family_stats"]
+    }, headers=headers)
+
+async def generate_family_coaching(family_id: str, family_obj: Family, children_data: List[dict], digest: str,
+                                   invalidations: int) -> dict:
+    # Generate coaching advice with Claude
+    response = await llm_gateway.send("family_coach", build_coaching_prompt(family_obj, children_data))
+    return await coaching_cache.put(
+        family_id, digest, family_obj.children, response, summarize_coaching_input(children_data), invalidations
+    )
+
+async def refresh_family_coaching(family_id: str) -> dict:
+    # Same cache rules as the route, without the streaming variants
+    cached = await coaching_cache.get(family_id)
+    if cached and not cached.get("stale"):
+        return cached
+    
+    family_obj, children_data, invalidations = await load_coaching_input(family_id)
+    digest = coaching_digest(family_obj.name, children_data)
+    if cached and cached["digest"] == digest:
+        await coaching_cache.revalidate(family_id, invalidations)
+        return cached
+    return await generate_family_coaching(family_id, family_obj, children_data, digest, invalidations)
+
+@api_router.get("/coaching/{family_id}")
+async def get_family_coaching(family_id: str, request: Request):
+    try:
+        # A fresh cached answer costs one indexed read and no LLM call
+        cached = await coaching_cache.get(family_id)
+        if cached and not cached.get("stale"):
+            if wants_event_stream(request):
+                return event_stream_response(stream_cached_coaching(family_id, cached))
+            return coaching_response(request, cached)
+        
+        family_obj, children_data, invalidations = await load_coaching_input(family_id)
+        digest = coaching_digest(family_obj.name, children_data)
+        if cached and cached["digest"] == digest:
+            await coaching_cache.revalidate(family_id, invalidations)
+            if wants_event_stream(request):
+                return event_stream_response(stream_cached_coaching(family_id, cached))
+            return coaching_response(request, cached)
+        
+        # Accept: text/event-stream sends the stats at once and streams the advice
+        if wants_event_stream(request):
+            return event_stream_response(stream_family_coaching(
+                request, family_id, family_obj, children_data, digest, invalidations
+            ))
+        
+        cached = await generate_family_coaching(family_id, family_obj, children_data, digest, invalidations)
+        return coaching_response(request, cached)
         
     except Exception as e:
         logging.error(f"Error generating coaching: {str(e)}")
         raise HTTPException(status_code=500, detail="Erreur lors de la génération des conseils")
 
+# Background jobs: the request returns a job id, a worker calls the LLM
+job_queue = JobQueue(
+    db,
+    workers=int(os.environ.get('JOB_WORKERS', 4)),
+    max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', 3)),
+)
+
+# How long an event stream waits before re-reading a job run by another process
+JOB_EVENTS_POLL_SECONDS = 2.0
+
+async def run_generation_job(payload: dict) -> dict:
+    try:
+        challenge = await generate_challenge_for(GenerateChallengeRequest(**payload))
+    except HTTPException as e:
+        raise PermanentJobError(e.detail)
+    return challenge.dict()
+
+async def run_coaching_job(payload: dict) -> dict:
+    try:
+        cached = await refresh_family_coaching(payload["family_id"])
+    except HTTPException as e:
+        raise PermanentJobError(e.detail)
+    return {
+        "family_id": cached["family_id"],
+        "coaching_advice": cached["coaching_advice"],
+        "family_stats": cached["family_stats"]
+    }
+
+job_queue.register("generate_challenge", run_generation_job)
+job_queue.register("family_coaching", run_coaching_job)
+
+@api_router.post("/jobs/challenges/generate", response_model=Job, status_code=202)
+async def submit_generation_job(request: GenerateChallengeRequest):
+    if not await db.children.find_one({"id": request.child_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Enfant non trouvé")
+    # Identical requests still waiting share one job
+    job = await job_queue.submit(
+        "generate_challenge", request.dict(), dedupe_key=f"{request.child_id}:{request.category or ''}"
+    )
+    return FastJSONResponse(job, status_code=202)
+
+@api_router.post("/jobs/coaching/{family_id}", response_model=Job, status_code=202)
+async def submit_coaching_job(family_id: str):
+    if not await db.families.find_one({"id": family_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Famille non trouvée")
+    job = await job_queue.submit("family_coaching", {"family_id": family_id}, dedupe_key=family_id)
+    return FastJSONResponse(job, status_code=202)
+
+@api_router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Tâche non trouvée")
+    return FastJSONResponse(job)
+
+async def job_events(request: Request, job: dict):
+    while True:
+        yield format_event("job", job)
+        if job["status"] in JOB_FINISHED or await request.is_disconnected():
+            return
+        job = await job_queue.wait(job["id"], timeout=JOB_EVENTS_POLL_SECONDS) or job
+
+@api_router.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    # Server-Sent Events: the job's state on every change, until it finishes
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Tâche non trouvée")
+    return event_stream_response(job_events(request, job))
+
+@api_router.get("/stats/jobs")
+async def get_job_stats():
+    return await job_queue.stats()
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Per-route latency and database usage; SLOW_REQUEST_MS logs the slow ones
+app.add_middleware(
+    MetricsMiddleware,
+    slow_request_ms=float(os.environ['SLOW_REQUEST_MS']) if os.environ.get('SLOW_REQUEST_MS') else None,
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", IDEMPOTENT_REPLAY_HEADER, NEXT_CURSOR_HEADER, SNAPSHOT_AGE_HEADER, SNAPSHOT_VERSION_HEADER],
 )
 
 # Configure logging
@@ -513,6 +1496,67 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def bootstrap_indexes():
+    await ensure_indexes(db)
+    # Diagnostic mode: explain each route's query shape and warn on COLLSCAN
+    if os.environ.get('INDEX_DIAGNOSTICS', '').lower() in ('1', 'true', 'yes'):
+        await run_diagnostics(db)
+
+@app.on_event("startup")
+async def start_challenge_pool():
+    challenge_pool.start()
+
+@app.on_event("startup")
+async def start_challenge_catalog():
+    catalog.start()
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_queue.start()
+
+@app.on_event("startup")
+async def start_leaderboard_snapshots():
+    leaderboard_snapshots.start()
+
+@app.on_event("startup")
+async def start_event_bus():
+    event_bus.start()
+
+@app.on_event("startup")
+async def start_screen_time_ingestor():
+    screen_time.start()
+
+background_tasks = set()
+
+async def run_migrations():
+    # Resumable, batched rewrite of legacy ISO-string timestamps
+    if os.environ.get('DATETIME_MIGRATION', '1').lower() not in ('0', 'false', 'no'):
+        await run_datetime_migration(db)
+    # Rollups of the completions recorded before they were maintained on write
+    await run_child_stats_backfill(db)
+    await run_activity_backfill(db)
+
+@app.on_event("startup")
+async def start_migrations():
+    task = asyncio.create_task(run_migrations())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+@app.on_event("startup")
+async def start_effects_sweeper():
+    task = asyncio.create_task(run_effects_sweeper())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in list(background_tasks):
+        task.cancel()
+    await challenge_pool.stop()
+    await catalog.stop()
+    await job_queue.stop()
+    await leaderboard_snapshots.stop()
+    await event_bus.stop()
+    await screen_time.stop()
     client.close()
\ No newline at end of file
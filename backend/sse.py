@@ -0,0 +1,23 @@
+from fastapi.responses import StreamingResponse
+
+from responses import dumps
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+def wants_event_stream(request) -> bool:
+    return SSE_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def format_event(event: str, data) -> str:
+    """Encode one Server-Sent Event; `data` is sent as JSON on a single line."""
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
+
+
+def event_stream_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type=SSE_MEDIA_TYPE,
+        # Keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from activity_buckets import DAY, WEEK, bucket_start
+from migrations import ACTIVITY_BUCKETS_MIGRATION, CHILD_STATS_MIGRATION, backfill_children, parse_datetime
+from versions import bump_versions
+
+logger = logging.getLogger(__name__)
+
+# Number of completions kept in `recent_challenges`
+RECENT_LIMIT = 5
+RECENT_FIELDS = ("id", "child_id", "challenge_id", "completed_at", "fun_credits_earned", "validation_method")
+
+# Set on every completion apply_completions and record_activity count.
+# Completions without it predate the rollups and are folded in once by
+# seed_child_stats and seed_activity_buckets.
+ROLLED_UP = "rolled_up"
+
+DUPLICATE_KEY = 11000
+
+
+def category_key(category: Optional[str]) -> str:
+    # Categories become field names under `categories`
+    key = (category or "other").replace(".", "_")
+    return "_" + key[1:] if key.startswith("$") else key
+
+
+def recent_entry(completed: dict) -> dict:
+    return {field: completed.get(field) for field in RECENT_FIELDS}
+
+
+async def apply_completions(db, completed_dicts: List[dict], challenge_metadata: Dict[str, dict]):
+    """Fold new completions into each child's `child_stats` document.
+
+    One upsert per child: totals and category counts are incremented and
+    the completions are appended to `recent_challenges`, capped with $slice.
+    A rollup created here is seeded with the child's older history at once.
+    """
+    by_child = defaultdict(list)
+    for completed in completed_dicts:
+        by_child[completed["child_id"]].append(completed)
+
+    operations = []
+    for child_id, completions in by_child.items():
+        inc = defaultdict(int)
+        for completed in completions:
+            inc["total_fun_credits"] += completed.get("fun_credits_earned", 0)
+            inc["total_challenges_completed"] += 1
+            metadata = challenge_metadata.get(completed["challenge_id"])
+            if metadata:
+                inc[f"categories.{category_key(metadata.get('category'))}"] += 1
+        operations.append(UpdateOne(
+            {"_id": child_id},
+            {
+                "$inc": dict(inc),
+                "$push": {"recent_challenges": {
+                    "$each": [recent_entry(c) for c in completions],
+                    "$slice": -RECENT_LIMIT,
+                }},
+            },
+            upsert=True,
+        ))
+    if operations:
+        result = await db.child_stats.bulk_write(operations, ordered=False)
+        if result.upserted_ids:
+            await seed_child_stats(db, list(result.upserted_ids.values()))
+
+
+def rebuild_pipeline(child_ids: Optional[List[str]] = None, legacy_only: bool = False) -> List[dict]:
+    match = {"child_id": {"$in": child_ids}} if child_ids is not None else {}
+    # Only what apply_completions never counted
+    legacy = {ROLLED_UP: {"$exists": False}} if legacy_only else {}
+    return [
+        {"$match": {**match, **legacy}},
+        {"$lookup": {
+            "from": "challenges",
+            "localField": "challenge_id",
+            "foreignField": "id",
+            "pipeline": [{"$project": {"_id": 0, "category": 1}}],
+            "as": "challenge",
+        }},
+        {"$group": {
+            "_id": {"child_id": "$child_id", "category": {"$first": "$challenge.category"}},
+            "known": {"$max": {"$gt": [{"$size": "$challenge"}, 0]}},
+            "count": {"$sum": 1},
+            "credits": {"$sum": {"$ifNull": ["$fun_credits_earned", 0]}},
+        }},
+        {"$group": {
+            "_id": "$_id.child_id",
+            "categories": {"$push": {"category": "$_id.category", "known": "$known", "count": "$count"}},
+            "total_challenges_completed": {"$sum": "$count"},
+            "total_fun_credits": {"$sum": "$credits"},
+        }},
+        {"$lookup": {
+            "from": "completed_challenges",
+            "localField": "_id",
+            "foreignField": "child_id",
+            "pipeline": [
+                {"$match": legacy},
+                {"$sort": {"completed_at": -1}},
+                {"$limit": RECENT_LIMIT},
+                {"$project": {"_id": 0, **{field: 1 for field in RECENT_FIELDS}}},
+            ],
+            "as": "recent_challenges",
+        }},
+    ]
+
+
+def rollup_fields(row: dict) -> dict:
+    categories = defaultdict(int)
+    for entry in row["categories"]:
+        # Completions of deleted challenges count in totals only
+        if entry["known"]:
+            categories[category_key(entry["category"])] += entry["count"]
+    return {
+        "categories": dict(categories),
+        "total_challenges_completed": row["total_challenges_completed"],
+        "total_fun_credits": row["total_fun_credits"],
+        "recent_challenges": list(reversed(row["recent_challenges"])),
+    }
+
+
+async def seed_child_stats(db, child_ids: Iterable[str]) -> List[str]:
+    """Fold the completions that predate the rollups into each child's rollup, once.
+
+    They are added in one update guarded by the `seeded` flag, so seeding
+    can be repeated and never races with apply_completions, which only
+    counts completions marked ROLLED_UP. Readers trust seeded rollups only.
+    Returns the children whose totals changed.
+    """
+    child_ids = list(child_ids)
+    if not child_ids:
+        return []
+    legacy = {}
+    # Most rollups are created by a new child's first completion, with nothing to fold in
+    if await db.completed_challenges.find_one({"child_id": {"$in": child_ids}, ROLLED_UP: {"$exists": False}},
+                                              {"_id": 1}):
+        async for row in db.completed_challenges.aggregate(rebuild_pipeline(child_ids, legacy_only=True),
+                                                           allowDiskUse=True):
+            legacy[row["_id"]] = rollup_fields(row)
+
+    operations = []
+    for child_id in child_ids:
+        update = {"$set": {"seeded": True}}
+        fields = legacy.get(child_id)
+        if fields:
+            update["$inc"] = {
+                "total_challenges_completed": fields["total_challenges_completed"],
+                "total_fun_credits": fields["total_fun_credits"],
+                **{f"categories.{key}": count for key, count in fields["categories"].items()},
+            }
+            # Older than anything apply_completions pushed: in front, newest kept
+            update["$push"] = {"recent_challenges": {
+                "$each": fields["recent_challenges"], "$position": 0, "$slice": -RECENT_LIMIT,
+            }}
+        operations.append(UpdateOne({"_id": child_id, "seeded": {"$ne": True}}, update, upsert=True))
+    try:
+        await db.child_stats.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # The upsert of a rollup seeded in the meantime collides with it
+        if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+            raise
+    await bump_versions(db, [f"child_stats:{child_id}" for child_id in legacy])
+    return list(legacy)
+
+
+async def seed_activity_buckets(db, child_ids: Iterable[str]) -> int:
+    """Fold the completions that predate the activity buckets into them, once.
+
+    Each bucket gets its legacy totals in one update guarded by its own
+    `seeded` flag, like seed_child_stats, so seeding can be repeated and
+    adds to what record_activity already counted instead of replacing it.
+    Returns the number of buckets that have legacy completions.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    async for completed in db.completed_challenges.find(
+        {"child_id": {"$in": list(child_ids)}, ROLLED_UP: {"$exists": False}},
+        {"_id": 0, "child_id": 1, "completed_at": 1, "fun_credits_earned": 1},
+    ):
+        completed_at = parse_datetime(completed.get("completed_at"))
+        if completed_at is None:
+            continue
+        for granularity in (DAY, WEEK):
+            key = (completed["child_id"], granularity, bucket_start(granularity, completed_at))
+            totals[key][0] += 1
+            totals[key][1] += completed.get("fun_credits_earned") or 0
+    if not totals:
+        return 0
+
+    operations = [
+        UpdateOne(
+            {"child_id": child_id, "granularity": granularity, "start": start, "seeded": {"$ne": True}},
+            {"$inc": {"challenges": challenges, "credits": credits}, "$set": {"seeded": True}},
+            upsert=True,
+        )
+        for (child_id, granularity, start), (challenges, credits) in totals.items()
+    ]
+    try:
+        await db.activity_buckets.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # The upsert of a bucket seeded in the meantime collides with it
+        if any(error["code"] != DUPLICATE_KEY for error in e.details.get("writeErrors", [])):
+            raise
+    return len(operations)
+
+
+async def _run_backfill(db, name: str, label: str, seed):
+    try:
+        state = await backfill_children(db, name, seed)
+        if state:
+            logger.info(f"{label} backfill finished: {state.get('processed', 0)} children")
+        return state
+    except Exception as e:
+        logger.error(f"{label} backfill stopped: {e}")
+
+
+async def run_child_stats_backfill(db):
+    """Seed every child's rollup, resumably, so lifetime totals need no fallback."""
+    return await _run_backfill(db, CHILD_STATS_MIGRATION, "Child stats", seed_child_stats)
+
+
+async def run_activity_backfill(db):
+    """Seed every child's activity buckets, resumably, so windows need no fallback."""
+    return await _run_backfill(db, ACTIVITY_BUCKETS_MIGRATION, "Activity buckets", seed_activity_buckets)
+
+
+async def rebuild_child_stats(db, child_ids: Optional[Iterable[str]] = None, batch_size: int = 1000) -> int:
+    """Recompute rollups from the raw completions.
+
+    Completions recorded while a child is being rebuilt can be overwritten,
+    so run this while writes are quiet or rebuild that child again after.
+    Without `child_ids`, rollups of children that no longer have any
+    completion are removed.
+    """
+    started_at = datetime.now(timezone.utc)
+    child_ids = list(child_ids) if child_ids is not None else None
+    rebuilt = 0
+    batch = []
+    async def write(rows):
+        await db.child_stats.bulk_write([
+            ReplaceOne({"_id": row["_id"]}, {**rollup_fields(row), "seeded": True, "rebuilt_at": started_at},
+                       upsert=True)
+            for row in rows
+        ], ordered=False)
+        # Cached stats responses must not outlive the rollups they came from
+        await bump_versions(db, [f"child_stats:{row['_id']}" for row in rows])
+
+    async for row in db.completed_challenges.aggregate(rebuild_pipeline(child_ids), allowDiskUse=True):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            await write(batch)
+            rebuilt += len(batch)
+            batch = []
+    if batch:
+        await write(batch)
+        rebuilt += len(batch)
+
+    if child_ids is None:
+        stale = await db.child_stats.distinct("_id", {"rebuilt_at": {"$lt": started_at}})
+        await db.child_stats.delete_many({"rebuilt_at": {"$lt": started_at}})
+        await bump_versions(db, [f"child_stats:{child_id}" for child_id in stale])
+    return rebuilt
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Rebuild the stats rollups from completed_challenges")
+    parser.add_argument("command", choices=["rebuild", "backfill-activity"])
+    parser.add_argument("--child-id", action="append", dest="child_ids", help="only rebuild these children")
+    args = parser.parse_args()
+
+    import server
+
+    try:
+        if args.command == "backfill-activity":
+            # Resumes an interrupted backfill; does nothing once it has finished
+            state = await run_activity_backfill(server.db)
+            print(state if state else "Activity buckets backfill already done or running elsewhere")
+        else:
+            rebuilt = await rebuild_child_stats(server.db, args.child_ids)
+            print(f"Rebuilt {rebuilt} child stats rollups")
+    finally:
+        server.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
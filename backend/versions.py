@@ -0,0 +1,90 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Tuple
+
+from pymongo import UpdateOne
+
+
+def etag_matches(request, etag: str) -> bool:
+    """Whether If-None-Match lists `etag` (weak comparison, as RFC 9110 asks)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+
+async def bump_versions(db, keys: Iterable[str]):
+    """Bump version counters from code that has no registry, such as scripts and migrations."""
+    keys = list(dict.fromkeys(keys))
+    if keys:
+        await db.versions.bulk_write(
+            [UpdateOne({"_id": key}, {"$inc": {"v": 1}}, upsert=True) for key in keys], ordered=False
+        )
+
+
+class VersionRegistry:
+    """Version counters of collections and entities, used to build ETags.
+
+    Write routes bump the keys they change, for example "children" and
+    "child:<id>". Counters live in the `versions` collection so every worker
+    sees every write; each worker caches them for `ttl` seconds, so a
+    conditional GET answered with 304 usually costs no database call at all.
+    A version read from the cache may lag another worker's write by up to
+    `ttl`; it never runs ahead of the data, because routes read versions
+    before they read documents.
+    """
+
+    def __init__(self, db, ttl: float = 1.0, maxsize: int = 100000):
+        self.db = db
+        self.collection = db.versions
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get_many(self, keys: List[str]) -> List[int]:
+        now = time.monotonic()
+        stale = [key for key in keys if key not in self._cache or now - self._cache[key][1] > self.ttl]
+        versions = {key: self._cache[key][0] for key in keys if key not in stale}
+        self.hits += len(versions)
+        self.misses += len(stale)
+        if stale:
+            found = {doc["_id"]: doc["v"] async for doc in self.collection.find({"_id": {"$in": stale}})}
+            for key in stale:
+                versions[key] = found.get(key, 0)
+                self._cache[key] = (versions[key], now)
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return [versions[key] for key in keys]
+
+    async def bump(self, *keys: str):
+        keys = list(dict.fromkeys(keys))
+        await bump_versions(self.db, keys)
+        # This worker sees its own writes at once
+        for key in keys:
+            self._cache.pop(key, None)
+
+    async def etag(self, request, keys: Iterable[str], extra: Iterable[str] = ()) -> str:
+        """Strong ETag of one representation: path, query, Accept and versions.
+
+        `extra` identifies any other state the body is built from, such as
+        the version of an in-memory copy that may lag the counters.
+        """
+        keys = list(keys)
+        versions = await self.get_many(keys)
+        source = "|".join([
+            request.url.path,
+            str(sorted(request.query_params.multi_items())),
+            request.headers.get("accept", ""),
+            *(f"{key}={version}" for key, version in zip(keys, versions)),
+            *extra,
+        ])
+        return f'"{hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]}"'
+
+    def stats(self) -> dict:
+        return {"cached_keys": len(self._cache), "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
@@ -14,10 +14,10 @@ class OFFAPITester:
         self.created_family_id = None
         self.created_challenge_id = None
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, timeout=30):
+    def run_test(self, name, method, endpoint, expected_status, data=None, timeout=30, headers=None):
         """Run a single API test"""
         url = f"{self.api_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': 'application/json', **(headers or {})}
 
         self.tests_run += 1
         print(f"\n🔍 Testing {name}...")
@@ -90,6 +90,31 @@ class OFFAPITester:
         """Test getting all children"""
         return self.run_test("Get All Children", "GET", "children", 200)
 
+    def test_get_children_page(self):
+        """Test keyset pagination on the children list"""
+        return self.run_test("Get Children Page", "GET", "children?limit=1", 200)
+
+    def test_get_children_etag(self):
+        """Test that an unchanged children list answers 304 and a new child changes its ETag"""
+        etag = requests.get(f"{self.api_url}/children", timeout=30).headers.get("ETag")
+        if not etag:
+            print("❌ No ETag on the children list")
+            self.tests_run += 1
+            return False
+        
+        success, _ = self.run_test(
+            "Get Children (unchanged)", "GET", "children", 304, headers={"If-None-Match": etag}
+        )
+        if not success:
+            return False
+        
+        requests.post(f"{self.api_url}/children", json={"name": "Test ETag", "age": 7}, timeout=30)
+        # Other workers cache versions for up to a second
+        time.sleep(1.5)
+        return self.run_test(
+            "Get Children (after a new child)", "GET", "children", 200, headers={"If-None-Match": etag}
+        )
+
     def test_get_child_by_id(self):
         """Test getting a specific child"""
         if not self.created_child_id:
@@ -181,6 +206,111 @@ class OFFAPITester:
             data=completion_data
         )
 
+    def test_complete_challenge_retry(self):
+        """Test that a retried completion is recorded once"""
+        if not self.created_child_id or not self.created_challenge_id:
+            print("❌ Skipped - Missing child or challenge ID")
+            return False
+            
+        completion_data = {
+            "child_id": self.created_child_id,
+            "challenge_id": self.created_challenge_id,
+            "validation_method": "parent"
+        }
+        headers = {"Idempotency-Key": f"backend-test-{datetime.now().timestamp()}"}
+        
+        success, first = self.run_test(
+            "Complete Challenge (first attempt)",
+            "POST",
+            "challenges/complete",
+            200,
+            data=completion_data,
+            headers=headers
+        )
+        if not success:
+            return False, first
+        
+        success, retry = self.run_test(
+            "Complete Challenge (retry)",
+            "POST",
+            "challenges/complete",
+            200,
+            data=completion_data,
+            headers=headers
+        )
+        if success and retry.get("id") != first.get("id"):
+            print(f"❌ Retry recorded a second completion: {retry}")
+            self.tests_passed -= 1
+            return False, retry
+        return success, retry
+
+    def test_complete_challenge_batch(self):
+        """Test completing several challenges in one request"""
+        if not self.created_child_id or not self.created_challenge_id:
+            print("❌ Skipped - Missing child or challenge ID")
+            return False
+            
+        completion_data = [
+            {
+                "child_id": self.created_child_id,
+                "challenge_id": self.created_challenge_id,
+                "validation_method": "parent"
+            },
+            {
+                "child_id": self.created_child_id,
+                "challenge_id": "unknown-challenge",
+                "validation_method": "parent"
+            }
+        ]
+        
+        success, response = self.run_test(
+            "Complete Challenge Batch",
+            "POST",
+            "challenges/complete/batch",
+            200,
+            data=completion_data
+        )
+        
+        if success and [r.get("status") for r in response] != ["created", "error"]:
+            print(f"❌ Unexpected batch results: {response}")
+            self.tests_passed -= 1
+            return False, response
+        return success, response
+
+    def test_generation_job(self):
+        """Test queueing an AI challenge generation and polling the job"""
+        if not self.created_child_id:
+            print("❌ Skipped - No child ID available")
+            return False
+            
+        success, job = self.run_test(
+            "Submit Generation Job",
+            "POST",
+            "jobs/challenges/generate",
+            202,
+            data={"child_id": self.created_child_id}
+        )
+        if not success:
+            return False
+        
+        print("   ⚠️  Polling the job while the AI generates the challenge...")
+        # Polls are not tests of their own: only the final status counts
+        url = f"{self.api_url}/jobs/{job['id']}"
+        for _ in range(30):
+            try:
+                job = requests.get(url, timeout=30).json()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                job = {"status": f"unreadable ({e})"}
+                break
+            if job.get("status") in ("done", "failed"):
+                break
+            time.sleep(2)
+        if job.get("status") != "done":
+            print(f"❌ Job did not finish: {job.get('status')} {job.get('error', '')}")
+            self.tests_passed -= 1
+            return False, job
+        return True, job
+
     def test_create_family(self):
         """Test creating a family"""
         family_data = {
@@ -231,6 +361,35 @@ class OFFAPITester:
             200
         )
 
+    def test_child_stats_etag(self):
+        """Test that unchanged stats answer 304 and a completion changes their ETag"""
+        if not self.created_child_id or not self.created_challenge_id:
+            print("❌ Skipped - Missing child or challenge ID")
+            return False
+        
+        endpoint = f"stats/child/{self.created_child_id}"
+        etag = requests.get(f"{self.api_url}/{endpoint}", timeout=30).headers.get("ETag")
+        if not etag:
+            print("❌ No ETag on the child stats")
+            self.tests_run += 1
+            return False
+        
+        success, _ = self.run_test(
+            "Get Child Stats (unchanged)", "GET", endpoint, 304, headers={"If-None-Match": etag}
+        )
+        if not success:
+            return False
+        
+        requests.post(f"{self.api_url}/challenges/complete", json={
+            "child_id": self.created_child_id,
+            "challenge_id": self.created_challenge_id,
+            "validation_method": "parent"
+        }, timeout=30)
+        time.sleep(1.5)
+        return self.run_test(
+            "Get Child Stats (after a completion)", "GET", endpoint, 200, headers={"If-None-Match": etag}
+        )
+
     def test_leaderboard(self):
         """Test getting the leaderboard"""
         return self.run_test("Get Leaderboard", "GET", "leaderboard", 200)
@@ -261,15 +420,21 @@ def main():
         ("Root Endpoint", tester.test_root_endpoint),
         ("Create Child", tester.test_create_child),
         ("Get All Children", tester.test_get_children),
+        ("Get Children Page", tester.test_get_children_page),
+        ("Children ETag", tester.test_get_children_etag),
         ("Get Child by ID", tester.test_get_child_by_id),
         ("Get All Challenges", tester.test_get_challenges),
         ("Create Manual Challenge", tester.test_create_challenge),
         ("AI Challenge Generation", tester.test_ai_challenge_generation),
         ("Complete Challenge", tester.test_complete_challenge),
+        ("Complete Challenge Retry", tester.test_complete_challenge_retry),
+        ("Complete Challenge Batch", tester.test_complete_challenge_batch),
+        ("AI Generation Job", tester.test_generation_job),
         ("Create Family", tester.test_create_family),
         ("Get All Families", tester.test_get_families),
         ("Add Child to Family", tester.test_add_child_to_family),
         ("Get Child Stats", tester.test_child_stats),
+        ("Child Stats ETag", tester.test_child_stats_etag),
         ("Get Leaderboard", tester.test_leaderboard),
         ("Family Coaching", tester.test_family_coaching),
     ]